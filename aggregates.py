@@ -0,0 +1,39 @@
+# aggregates.py
+#
+# Streaming of the primary survey into the counts behind the
+# 'geography' and 'connection' chapters.
+#
+# For survey files too large to load at once, this reads the SPSS
+# file in chunks of rows and keeps only the counts that the chapters
+# aggregate the respondents into: respondents by state and religion,
+# and responses to each issue by religion. The counts are written to
+# data/counts.npz together with the fingerprint of the survey, and
+# the application uses them in place of the respondents for as long
+# as the survey is unchanged. The 'evolution' chapter is streamed
+# by evolution.py in the same way.
+#
+#   python aggregates.py
+
+import survey
+import streamlit_app as app
+
+# -----------------------------------------------------------------------------
+# Main
+# -----------------------------------------------------------------------------
+
+def main():
+    # Taken first, so that a survey replaced while streaming is counted again
+    fingerprint = survey.source_fingerprint()
+
+    print("[+] Streaming '{}'...".format(survey.PRIMARY_DATA_PATH))
+    counts = survey.stream_counts(app.COUNT_PAIRS)
+    survey.write_counts(counts, fingerprint)
+    print("[+] Wrote '{}'".format(survey.COUNTS_PATH))
+    print("[+] Done!")
+
+# -----------------------------------------------------------------------------
+# Script Entry Point
+# -----------------------------------------------------------------------------
+
+if __name__ == "__main__":
+    main()
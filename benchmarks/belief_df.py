@@ -0,0 +1,79 @@
+# belief_df.py
+#
+# Benchmark for create_belief_df in the 'connection' chapter.
+#
+# Compares the current implementation (a single isin mask, with labels
+# attached through an array lookup) against the previous one (a loop of
+# boolean filters, then a nested-dict DataFrame.replace), on the full
+# survey and on a synthetic survey built by repeating it.
+#
+# Run from the repository root: python -m benchmarks.belief_df
+
+import time
+
+import pandas as pd
+
+import streamlit_app as app
+import survey
+
+# The number of times each implementation is timed; we report the best
+REPEATS = 5
+
+# The sizes of the surveys to benchmark, as multiples of the full survey
+SCALES = [1, 10]
+
+def legacy_create_belief_df(df):
+    """
+    :param df The primary dataset, with float64 codes
+    :return The belief dataframe, as computed before vectorization
+    """
+    beliefdf = df[app.CONNECTION_COLUMNS].copy()
+    beliefdf = beliefdf.rename(columns=app.BELIEF_DICT)
+    for val in app.DROPPED_RELIGION_CODES:
+        beliefdf = beliefdf[beliefdf.Religion != val]
+    return beliefdf.replace(app.BELIEF_RESPONSE_DICTS)
+
+def current_create_belief_df(df):
+    """
+    :param df The primary dataset, with compact codes
+    :return The belief dataframe, labelled for display
+    """
+    return app.decode_belief_df(app.create_belief_df(df))
+
+def best_time(function, df):
+    """
+    :param function The function to time
+    :param df The input to the function
+    :return The best time over REPEATS runs, and the result
+    """
+    best = float("inf")
+    for _ in range(REPEATS):
+        start = time.perf_counter()
+        result = function(df)
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+def check(legacy, current):
+    """
+    Check that the implementations agree on every labelled answer.
+    """
+    labelled = current.notna()
+    assert legacy.index.equals(current.index)
+    assert legacy[labelled].astype(str).equals(current[labelled].astype(str))
+
+def main():
+    df = survey.read_primary_data(app.CONNECTION_COLUMNS)
+    for scale in SCALES:
+        scaled = pd.concat([df]*scale, ignore_index=True)
+        legacy_time, legacy = best_time(legacy_create_belief_df, scaled.astype(float))
+        current_time, current = best_time(current_create_belief_df, scaled)
+        check(legacy, current)
+
+        print("[+] {}x survey ({} respondents)".format(scale, len(scaled)))
+        print("    legacy:  {:8.1f} ms, {:8.1f} MB".format(
+            legacy_time*1000, legacy.memory_usage(deep=True).sum() / 2**20))
+        print("    current: {:8.1f} ms, {:8.1f} MB".format(
+            current_time*1000, current.memory_usage(deep=True).sum() / 2**20))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,300 @@
+# hot_paths.py
+#
+# Benchmarks for every data-preparation hot path of the application.
+#
+# Each benchmark times one function at several input sizes and checks
+# its result at each size against a golden output, so that an
+# optimization can be measured and shown not to change the results.
+# Survey sizes are numbers of respondents; future sizes are numbers of
+# projected years.
+#
+# The primary survey is not distributed with the repository, so the
+# surveys are synthetic ones from synthetic.py, generated from a fixed
+# seed and read through their Arrow copy as the application reads the
+# primary survey. The golden outputs are committed alongside this file;
+# a run compares against them, and fails if any result differs. Record
+# them again (with --update) only for a change that is meant to change
+# the results, such as a change to the synthetic surveys.
+#
+# Run from the repository root: python -m benchmarks.hot_paths [--update] [name ...]
+
+import os
+import statistics
+import sys
+import tempfile
+import time
+from collections import namedtuple
+
+import altair as alt
+import numpy as np
+import pandas as pd
+
+import evolution
+import future
+import streamlit_app as app
+import survey
+import synthetic
+
+# -----------------------------------------------------------------------------
+# General Constants
+# -----------------------------------------------------------------------------
+
+# The directory in which golden outputs are recorded
+GOLDEN_PATH = "benchmarks/golden/"
+
+# The number of times each function is timed at each size
+REPEATS = 5
+
+# The sizes of the surveys, from the size of the primary survey up
+ROWS = [synthetic.ROWS, 4*synthetic.ROWS, 16*synthetic.ROWS]
+
+# The seed for the surveys, so that every run sees the same respondents
+SEED = synthetic.SEED
+
+# The numbers of projected years
+YEARS = [100, 1000, 10000]
+
+# The number of starting distributions projected together
+STARTS = 1000
+
+# The relative tolerance for floating-point results
+RTOL = 1e-9
+
+# The inputs to the comparison chart
+BELIEF_ISSUE = "Abortion"
+BELIEF_RELIGIONS = ["Protestant", "Roman Catholic", "Muslim", "Atheist"]
+
+# A benchmark:
+#   name     The name under which the benchmark is reported and recorded
+#   sizes    The input sizes
+#   setup    A function of the size that returns the arguments, untimed
+#   run      The timed function of those arguments
+#   result   A function of the output that returns the frame to check
+Benchmark = namedtuple("Benchmark", ["name", "sizes", "setup", "run", "result"])
+
+# -----------------------------------------------------------------------------
+# Inputs
+# -----------------------------------------------------------------------------
+
+# The surveys are generated once per run, into a directory removed at exit
+SURVEYS = tempfile.TemporaryDirectory(prefix="hot_paths-")
+
+def read_survey(columns, rows):
+    """
+    :param columns The columns of the survey to read
+    :param rows The number of respondents
+    :return The synthetic survey of that size
+    """
+    path = os.path.join(SURVEYS.name, "{}.arrow".format(rows))
+    if not os.path.exists(path):
+        synthetic.generate(rows, path, SEED)
+
+    # There is no SPSS file, so the Arrow copy is read as-is, 
+    # as when a deployment ships only the converted survey
+    return survey.read_primary_data(columns, source=path + ".sav", target=path)
+
+def read_states(rows):
+    df = read_survey(app.GEOGRAPHY_COLUMNS, rows)
+    return app.prepare_states(df, app.RELIGION_DICT, app.STATE_DICT)
+
+def read_cube(rows):
+    return app.create_belief_cube(app.create_belief_df(read_survey(app.CONNECTION_COLUMNS, rows)))
+
+def read_future(years):
+    return future.transform_input_data(future.generate_input_data(years))
+
+def read_starts():
+    # Random distributions of the religions, the same on every run
+    return np.random.default_rng(SEED).dirichlet(np.ones(future.INITIAL_DISTRIBUTION.size), STARTS)
+
+# -----------------------------------------------------------------------------
+# Results
+# -----------------------------------------------------------------------------
+
+def cube_frame(cube):
+    """
+    :param cube The belief cube
+    :return The cube as a frame, with one row per issue and religion code
+    """
+    index = pd.MultiIndex.from_product(
+        [app.BELIEF_ISSUES, range(cube.shape[1])], names=["Issue", "Religion"])
+    return pd.DataFrame(cube.reshape(-1, cube.shape[2]), index=index)
+
+def digest_frame(df):
+    """
+    :param df A frame of respondents, too large to record in full
+    :return One row for the index and for each column, with its type, the number
+    of values present and a hash of every value together with its row label
+    """
+    def digest(hashes):
+        return np.bitwise_xor.reduce(hashes.to_numpy(), initial=np.uint64(0))
+
+    return pd.DataFrame({
+        "Column": ["(index)"] + list(df.columns),
+        "Type": [str(df.index.dtype)] + [str(t) for t in df.dtypes],
+        "Present": [len(df.index)] + list(df.count()),
+        "Hash": [digest(pd.util.hash_pandas_object(df.index))] + [
+            digest(pd.util.hash_pandas_object(df[column])) for column in df.columns]})
+
+def counts_frame(counts):
+    """
+    :param counts Map question -> counts, as from evolution.count_all_responses
+    :return The counts as a frame, with one row per question, age and response
+    """
+    frames = []
+    for question, c in counts.items():
+        ages, responses = c.shape
+        frames.append(pd.DataFrame({
+            "Question": question,
+            "Age": np.repeat(c.index.to_numpy(np.float64, na_value=np.nan), responses),
+            "Response": np.tile(c.columns.to_numpy(np.float64, na_value=np.nan), ages),
+            "Count": c.to_numpy(np.int64).ravel()}))
+    return pd.concat(frames, ignore_index=True)
+
+# -----------------------------------------------------------------------------
+# Benchmarks
+# -----------------------------------------------------------------------------
+
+BENCHMARKS = [
+    Benchmark(
+        name="evolution.processor",
+        sizes=ROWS,
+        setup=lambda rows: (
+            read_survey(evolution.COLUMNS, rows),
+            evolution.BELIEVE_IN_GOD.question,
+            evolution.BELIEVE_IN_GOD.response_map),
+        run=evolution.processor,
+        result=lambda df: df),
+    Benchmark(
+        name="evolution.count_all_responses",
+        sizes=ROWS,
+        setup=lambda rows: (read_survey(evolution.COLUMNS, rows),),
+        run=evolution.count_all_responses,
+        result=counts_frame),
+    Benchmark(
+        name="future.generate_input_data",
+        sizes=YEARS,
+        setup=lambda years: (years,),
+        run=future.generate_input_data,
+        result=lambda df: df),
+    Benchmark(
+        name="future.project",
+        sizes=YEARS,
+        setup=lambda years: (read_starts(), years),
+        run=future.project,
+        result=lambda projection: pd.DataFrame(projection, columns=future.FUTURE_COLUMN_HEADERS)),
+    Benchmark(
+        name="future.transform_input_data",
+        sizes=YEARS,
+        setup=lambda years: (future.generate_input_data(years),),
+        run=future.transform_input_data,
+        result=lambda df: df),
+    Benchmark(
+        name="prepare_states",
+        sizes=ROWS,
+        setup=lambda rows: (
+            read_survey(app.GEOGRAPHY_COLUMNS, rows),
+            app.RELIGION_DICT,
+            app.STATE_DICT),
+        run=app.prepare_states,
+        result=lambda df: df),
+    Benchmark(
+        name="create_belief_df",
+        sizes=ROWS,
+        setup=lambda rows: (read_survey(app.CONNECTION_COLUMNS, rows),),
+        run=app.create_belief_df,
+        result=digest_frame),
+    Benchmark(
+        name="create_belief_cube",
+        sizes=ROWS,
+        setup=lambda rows: (app.create_belief_df(read_survey(app.CONNECTION_COLUMNS, rows)),),
+        run=app.create_belief_cube,
+        result=cube_frame),
+    Benchmark(
+        name="create_belief_compare_chart_from_cube",
+        sizes=ROWS,
+        setup=lambda rows: (read_cube(rows), BELIEF_ISSUE, BELIEF_RELIGIONS),
+        run=app.create_belief_compare_chart_from_cube,
+        result=lambda chart: chart.data),
+    Benchmark(
+        name="stackedtablereligion",
+        sizes=ROWS,
+        setup=lambda rows: (read_states(rows), alt.selection_point(fields=["State"])),
+        run=app.stackedtablereligion,
+        result=lambda chart: chart.data),
+    Benchmark(
+        name="preprocess_for_diff_viz",
+        sizes=YEARS,
+        setup=lambda years: (read_future(years),),
+        run=app.preprocess_for_diff_viz,
+        result=lambda df: df)
+]
+
+# -----------------------------------------------------------------------------
+# Engine
+# -----------------------------------------------------------------------------
+
+def golden_path(benchmark, size):
+    return GOLDEN_PATH + "{}-{}.parquet".format(benchmark.name, size)
+
+def check(benchmark, size, result, update):
+    """
+    :param benchmark The benchmark
+    :param size The input size
+    :param result The frame to check
+    :param update Whether to record the result as the golden output
+    :return A description of the outcome, and whether the result is correct
+    """
+    # Parquet keeps the types of the columns, but only names them by strings
+    result = result.rename(columns=str)
+
+    path = golden_path(benchmark, size)
+    if update:
+        os.makedirs(GOLDEN_PATH, exist_ok=True)
+        result.to_parquet(path)
+        return "recorded", True
+    if not os.path.exists(path):
+        return "no golden output", False
+
+    golden = pd.read_parquet(path)
+    try:
+        pd.testing.assert_frame_equal(result, golden, check_exact=False, rtol=RTOL)
+    except AssertionError as e:
+        return "differs: {}".format(" ".join(str(e).split())), False
+    return "ok", True
+
+def time_runs(run, args):
+    """
+    :param run The function to time
+    :param args The arguments to the function
+    :return The times of REPEATS runs, and the last result
+    """
+    times = []
+    for _ in range(REPEATS):
+        start = time.perf_counter()
+        output = run(*args)
+        times.append(time.perf_counter() - start)
+    return times, output
+
+def main():
+    update = "--update" in sys.argv[1:]
+    names = [arg for arg in sys.argv[1:] if not arg.startswith("--")]
+
+    failed = False
+    for benchmark in BENCHMARKS:
+        if names and benchmark.name not in names:
+            continue
+
+        print("[+] {}".format(benchmark.name))
+        for size in benchmark.sizes:
+            times, output = time_runs(benchmark.run, benchmark.setup(size))
+            outcome, correct = check(benchmark, size, benchmark.result(output), update)
+            failed = failed or not correct
+            print("    {:>6}: best {:9.2f} ms, median {:9.2f} ms ({})".format(
+                size, min(times)*1000, statistics.median(times)*1000, outcome))
+
+    if failed:
+        sys.exit("[-] Some results differ from their golden outputs")
+
+if __name__ == "__main__":
+    main()
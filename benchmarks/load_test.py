@@ -0,0 +1,301 @@
+# load_test.py
+#
+# A load test of the application with concurrent sessions.
+#
+# This starts the application with `streamlit run` and connects several
+# clients to it at once over the same websocket protocol the browser
+# speaks. Every client loads the application and then follows a random
+# script of the interactions that rerun it: switching the belief issue,
+# choosing religions, switching the evolution question and toggling
+# absolute differences. As in the browser, a widget inside a chapter
+# reruns only that chapter (a fragment), while a widget in the sidebar
+# reruns the whole application. The server runs in its own process,
+# as in a deployment, and its peak resident set size is read from
+# /proc, so the test runs on Linux only. The clients share one event
+# loop in this process and do little more than wait on the server.
+#
+# Picking states on the map and scrubbing the age slider are filtered in
+# the browser and never rerun the application, so they add no load here.
+#
+# Run from the repository root: python -m benchmarks.load_test [sessions] [steps]
+
+import asyncio
+import random
+import statistics
+import subprocess
+import sys
+import time
+from collections import namedtuple
+from urllib.error import URLError
+from urllib.request import urlopen
+
+import numpy as np
+import websockets
+from streamlit.proto.BackMsg_pb2 import BackMsg
+from streamlit.proto.ForwardMsg_pb2 import ForwardMsg
+from streamlit.proto.WidgetStates_pb2 import WidgetState
+
+# -----------------------------------------------------------------------------
+# General Constants
+# -----------------------------------------------------------------------------
+
+# The application under test
+APP_PATH = "streamlit_app.py"
+
+# The port on which the application is served
+PORT = 8599
+
+# The route at which the server reports that it is ready
+HEALTH_ROUTE = "/_stcore/health"
+
+# The route of the websocket through which a session talks to the server
+STREAM_ROUTE = "/_stcore/stream"
+
+# The number of seconds to wait for the server to start
+STARTUP_TIMEOUT = 60
+
+# The default number of concurrent sessions
+SESSIONS = 8
+
+# The default number of interactions in each session
+STEPS = 25
+
+# The number of seconds a single run may take
+TIMEOUT = 120
+
+# The seed for the scripts of the sessions, so that runs are comparable
+SEED = 2021
+
+# The percentiles of latency that are reported
+PERCENTILES = (50, 95, 99)
+
+# The widget types that the interactions use
+WIDGET_TYPES = ["checkbox", "multiselect", "radio", "selectbox"]
+
+# A widget displayed by the last run of a session:
+#   proto        The element, with the id, options and default of the widget
+#   fragment_id  The fragment that displayed it, or "" outside of fragments
+Widget = namedtuple("Widget", ["proto", "fragment_id"])
+
+# -----------------------------------------------------------------------------
+# Interactions
+# -----------------------------------------------------------------------------
+
+# Every interaction is a function of the widgets displayed by the last run
+# and a random number generator; it returns the widget it changes and the
+# new state of that widget, or None if the last run did not display it
+
+def switch_issue(widgets, rng):
+    radio = widgets.get("Belief or Issue")
+    if radio:
+        return radio, WidgetState(string_value=rng.choice(radio.proto.options))
+
+def choose_religions(widgets, rng):
+    multiselect = widgets.get("Religion")
+    if multiselect:
+        state = WidgetState()
+        state.string_array_value.data.extend(
+            rng.sample(list(multiselect.proto.options), rng.randint(1, 4)))
+        return multiselect, state
+
+def switch_question(widgets, rng):
+    selectbox = widgets.get("Question")
+    if selectbox:
+        return selectbox, WidgetState(string_value=rng.choice(selectbox.proto.options))
+
+def toggle_absolute_differences(widgets, rng):
+    checkbox = widgets.get("Show Absolute Differences")
+    if checkbox:
+        return checkbox, WidgetState(bool_value=rng.random() < 0.5)
+
+# The interactions of a session, with the relative frequency of each
+INTERACTIONS = [
+    (switch_issue, 3),
+    (choose_religions, 3),
+    (switch_question, 2),
+    (toggle_absolute_differences, 1)
+]
+
+# -----------------------------------------------------------------------------
+# Sessions
+# -----------------------------------------------------------------------------
+
+class Session:
+    def __init__(self, websocket):
+        """
+        :param websocket The open websocket of the session
+        """
+        self.websocket = websocket
+
+        # Map label -> every widget displayed so far; a fragment rerun
+        # displays only the widgets of its chapter
+        self.widgets = {}
+
+        # Map widget id -> the state of every widget changed so far, all
+        # of which the browser sends along with every rerun
+        self.states = {}
+
+    async def run(self, fragment_id=""):
+        """
+        :param fragment_id The fragment to rerun, or "" to run the application
+        :return The number of seconds the run took, and its errors
+        """
+        msg = BackMsg()
+        msg.rerun_script.fragment_id = fragment_id
+        msg.rerun_script.widget_states.widgets.extend(self.states.values())
+
+        start = time.perf_counter()
+        await self.websocket.send(msg.SerializeToString())
+
+        errors = []
+        while True:
+            msg = ForwardMsg()
+            msg.ParseFromString(await self.websocket.recv())
+            kind = msg.WhichOneof("type")
+
+            if kind == "delta" and msg.delta.WhichOneof("type") == "new_element":
+                element = msg.delta.new_element
+                element_type = element.WhichOneof("type")
+                if element_type in WIDGET_TYPES:
+                    widget = getattr(element, element_type)
+                    self.widgets[widget.label] = Widget(widget, msg.delta.fragment_id)
+                elif element_type == "exception":
+                    errors.append("{}: {}".format(element.exception.type, element.exception.message))
+
+            elif kind == "script_finished":
+                if msg.script_finished == ForwardMsg.FINISHED_WITH_COMPILE_ERROR:
+                    errors.append("The application failed to compile")
+                return time.perf_counter() - start, errors
+
+    async def interact(self, interaction, rng):
+        """
+        :param interaction The interaction
+        :param rng The random number generator of the session
+        :return Whether it reran a fragment, the number of seconds the rerun
+        took and its errors, or None if the widget was not displayed
+        """
+        change = interaction(self.widgets, rng)
+        if change is None:
+            return None
+
+        widget, state = change
+        state.id = widget.proto.id
+        self.states[state.id] = state
+        seconds, errors = await self.run(widget.fragment_id)
+        return bool(widget.fragment_id), seconds, errors
+
+async def run_session(url, index, steps, results):
+    """
+    :param url The websocket URL of the application
+    :param index The index of the session, which seeds its script
+    :param steps The number of interactions
+    :param results Map "load" | "fragment" | "full" | "errors" -> list to append to
+    """
+    rng = random.Random(SEED + index)
+    interactions, weights = zip(*INTERACTIONS)
+
+    async with websockets.connect(url, subprotocols=["streamlit"], max_size=None) as websocket:
+        session = Session(websocket)
+        seconds, errors = await asyncio.wait_for(session.run(), TIMEOUT)
+        results["load"].append(seconds)
+        results["errors"].extend(errors)
+
+        for _ in range(steps):
+            interaction = rng.choices(interactions, weights)[0]
+            outcome = await asyncio.wait_for(session.interact(interaction, rng), TIMEOUT)
+            if outcome is None:
+                results["errors"].append("'{}' found no widget".format(interaction.__name__))
+                continue
+            fragment, seconds, errors = outcome
+            results["fragment" if fragment else "full"].append(seconds)
+            results["errors"].extend(errors)
+
+async def run_sessions(url, sessions, steps):
+    """
+    :param url The websocket URL of the application
+    :param sessions The number of concurrent sessions
+    :param steps The number of interactions in each session
+    :return The results, as from run_session
+    """
+    results = {"load": [], "fragment": [], "full": [], "errors": []}
+    await asyncio.gather(*[run_session(url, i, steps, results) for i in range(sessions)])
+    return results
+
+# -----------------------------------------------------------------------------
+# Server
+# -----------------------------------------------------------------------------
+
+def start_server(port):
+    """
+    :param port The port on which to serve the application
+    :return The server process, once it is ready
+    """
+    server = subprocess.Popen(
+        [sys.executable, "-m", "streamlit", "run", APP_PATH,
+         "--server.headless=true", "--server.port={}".format(port)],
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+    deadline = time.monotonic() + STARTUP_TIMEOUT
+    while True:
+        try:
+            with urlopen("http://localhost:{}{}".format(port, HEALTH_ROUTE)) as response:
+                response.read()
+            return server
+        except URLError:
+            if server.poll() is not None or time.monotonic() > deadline:
+                server.kill()
+                raise RuntimeError("The server did not start")
+            time.sleep(0.5)
+
+def peak_rss(pid):
+    """
+    :param pid The process id of the server
+    :return The peak resident set size of the server, in MB
+    """
+    with open("/proc/{}/status".format(pid)) as f:
+        for line in f:
+            if line.startswith("VmHWM:"):
+                return int(line.split()[1]) / 1024
+
+# -----------------------------------------------------------------------------
+# Main
+# -----------------------------------------------------------------------------
+
+def report_latencies(name, seconds):
+    if not seconds:
+        print("[+] {}: none".format(name))
+        return
+    print("[+] {}: {} runs, {}".format(name, len(seconds), ", ".join(
+        "p{} {:.0f} ms".format(p, v*1000)
+        for p, v in zip(PERCENTILES, np.percentile(seconds, PERCENTILES)))))
+
+def main():
+    sessions = int(sys.argv[1]) if len(sys.argv) > 1 else SESSIONS
+    steps = int(sys.argv[2]) if len(sys.argv) > 2 else STEPS
+
+    print("[+] Starting the server...")
+    server = start_server(PORT)
+    try:
+        print("[+] Running {} sessions of {} interactions...".format(sessions, steps))
+        url = "ws://localhost:{}{}".format(PORT, STREAM_ROUTE)
+        start = time.perf_counter()
+        results = asyncio.run(run_sessions(url, sessions, steps))
+        elapsed = time.perf_counter() - start
+        rss = peak_rss(server.pid)
+    finally:
+        server.terminate()
+        server.wait()
+
+    runs = len(results["load"]) + len(results["fragment"]) + len(results["full"])
+    print("[+] First load: median {:.0f} ms, max {:.0f} ms".format(
+        statistics.median(results["load"])*1000, max(results["load"])*1000))
+    report_latencies("Fragment reruns", results["fragment"])
+    report_latencies("Full reruns", results["full"])
+    print("[+] Throughput: {:.1f} runs/s ({} runs in {:.1f} s)".format(runs / elapsed, runs, elapsed))
+    print("[+] Peak RSS of the server: {:.0f} MB".format(rss))
+    print("[+] Errors: {}".format(len(results["errors"])))
+    for error in sorted(set(results["errors"])):
+        print("    {}".format(error))
+
+if __name__ == "__main__":
+    main()
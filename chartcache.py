@@ -0,0 +1,70 @@
+# chartcache.py
+#
+# A bounded, least-recently-used cache of finished chart specs.
+#
+# Building an Altair chart and serializing it to a Vega-Lite spec
+# costs far more than displaying the spec, and most reruns ask for
+# a chart that has been built before with exactly the same inputs.
+# A single cache is shared by every session, so it may be used from
+# several threads at once.
+
+import threading
+from collections import OrderedDict
+
+class ChartCache:
+    def __init__(self, maxsize):
+        """
+        :param maxsize The greatest number of specs kept; the
+        least recently used spec is evicted to make room
+        """
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self.specs = OrderedDict()
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.specs)
+
+    def get(self, key, build):
+        """
+        :param key A hashable key for the chart: its kind, the version
+        of its data and the selections from which it is built
+        :param build A function that builds the spec on a miss
+        :return The spec, which is shared and must not be modified
+        """
+        with self.lock:
+            if key in self.specs:
+                self.specs.move_to_end(key)
+                self.hits += 1
+                return self.specs[key]
+            self.misses += 1
+
+        # Build outside of the lock so that a slow chart does not hold
+        # up the others; racing sessions may both build the same spec
+        spec = build()
+
+        with self.lock:
+            self.specs[key] = spec
+            self.specs.move_to_end(key)
+            while len(self.specs) > self.maxsize:
+                self.specs.popitem(last=False)
+        return spec
+
+    def clear(self):
+        with self.lock:
+            self.specs.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def stats(self):
+        """
+        :return Map statistic -> value, for diagnostics
+        """
+        with self.lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "size": len(self.specs),
+                "maxsize": self.maxsize
+            }
@@ -1,10 +1,17 @@
 # evolution.py 
 #
 # Preprocessing for the 'evolution' chapter.
+#
+# Each question of interest is described once, in the registry
+# below; the application discovers the questions from there too.
+
+from collections import namedtuple
 
 import numpy as np
 import pandas as pd
 
+import survey
+
 # -----------------------------------------------------------------------------
 # General Constants
 # -----------------------------------------------------------------------------
@@ -12,9 +19,6 @@ import pandas as pd
 # The relative path to the data directory
 DATA_PATH = "data/"
 
-# The location of the data 
-DATA_FILE = DATA_PATH + "data.sav"
-
 # The minimum and maximum age in the dataset
 MIN_AGE = 24
 MAX_AGE = 90
@@ -42,109 +46,105 @@ AGE_MAP = {
 AGE_KEY = "agerec"
 
 # -----------------------------------------------------------------------------
-# Believe in God
-# -----------------------------------------------------------------------------
-
-# The output filename for the processed data
-BELIEVE_IN_GOD_FILENAME = "believe_god.csv"
-
-# The identifier for the question in the input dataframe
-BELIEVE_IN_GOD_Q = "qg1"
-
-# Map response label -> response text
-BELIEVE_IN_GOD_RESPONSE_MAP = {
-    1.0: "Yes",
-    2.0: "No",
-    9.0: "Don't Know",
-    3.0: "Other"
-}
-
-# -----------------------------------------------------------------------------
-# Believe in Heaven
-# -----------------------------------------------------------------------------
-
-# The output filename for the processed data
-BELIEVE_IN_HEAVEN_FILENAME = "believe_heaven.csv"
-
-# The identifier for the question in the input dataframe
-BELIEVE_IN_HEAVEN_Q = "qg5"
-
-# Map response label -> response text
-BELIEVE_IN_HEAVEN_RESPONSE_MAP = {
-    1.0: "Yes",
-    2.0: "No",
-    9.0: "Don't Know",
-    3.0: "Other"
-}
-
-# -----------------------------------------------------------------------------
-# Believe in Hell
-# -----------------------------------------------------------------------------
-
-# The output filename for the processed data
-BELIEVE_IN_HELL_FILENAME = "believe_hell.csv"
-
-# The identifier for the question in the input dataframe
-BELIEVE_IN_HELL_Q = "qg6"
-
-# Map response label -> response text
-BELIEVE_IN_HELL_RESPONSE_MAP = {
-    1.0: "Yes",
-    2.0: "No",
-    9.0: "Don't Know",
-    3.0: "Other"
-}
-
-# -----------------------------------------------------------------------------
-# Right and Wrong
-# -----------------------------------------------------------------------------
-
-# The output filename for the processed data
-RIGHT_AND_WRONG_FILENAME = "right_and_wrong.csv"
-
-# The identifier for the question in the input dataframe
-RIGHT_AND_WRONG_Q = "qb31"
-
-# Map response label -> response text
-RIGHT_AND_WRONG_RESPONSE_MAP = {
-    1.0: "Religious Teaching / Beliefs",
-    2.0: "Philosophy and Reason",
-    3.0: "Practical Experience / Common Sense",
-    4.0: "Scientific Information",
-    9.0: "Don't Know"
-}
-
-# -----------------------------------------------------------------------------
-# Scripture
-# -----------------------------------------------------------------------------
-
-# The output filename for the processed data
-SCRIPTURE_FILENAME = "scripture.csv"
-
-# The identifier for the question in the input dataframe
-SCRIPTURE_Q = "qg7"
-
-# Map response label -> response text
-SCRIPTURE_RESPONSE_MAP = {
-    1.0: "The Word of God",
-    2.0: "The Work of Men",
-    3.0: "Other",
-    9.0: "Don't Know"
-}
+# Question Registry
+# -----------------------------------------------------------------------------
+
+# A question whose responses we follow across ages:
+#   title         The question as presented in the application
+#   question      The identifier for the question in the input dataframe
+#   response_map  Map response label -> response text
+#   filename      The output filename for the processed data
+#   full_text     The full text of the question posed in the survey
+Question = namedtuple("Question", [
+    "title", 
+    "question", 
+    "response_map", 
+    "filename", 
+    "full_text"])
+
+BELIEVE_IN_GOD = Question(
+    title="Do You Believe in God?",
+    question="qg1",
+    response_map={
+        1.0: "Yes",
+        2.0: "No",
+        9.0: "Don't Know",
+        3.0: "Other"
+    },
+    filename="believe_god.csv",
+    full_text="Do you believe in God or a universal spirit?")
+
+BELIEVE_IN_HEAVEN = Question(
+    title="Do You Believe in Heaven?",
+    question="qg5",
+    response_map={
+        1.0: "Yes",
+        2.0: "No",
+        9.0: "Don't Know",
+        3.0: "Other"
+    },
+    filename="believe_heaven.csv",
+    full_text="Do you think there is a heaven, where people who have led good lives are eternally rewarded?")
+
+BELIEVE_IN_HELL = Question(
+    title="Do You Believe in Hell?",
+    question="qg6",
+    response_map={
+        1.0: "Yes",
+        2.0: "No",
+        9.0: "Don't Know",
+        3.0: "Other"
+    },
+    filename="believe_hell.csv",
+    full_text="Do you think there is a hell, where people who have led bad lives and die without being sorry are eternally punished?")
+
+RIGHT_AND_WRONG = Question(
+    title="Where Do You Look for Guidance on Questions of Right and Wrong?",
+    question="qb31",
+    response_map={
+        1.0: "Religious Teaching and Beliefs",
+        2.0: "Philosophy and Reason",
+        3.0: "Practical Experience and Common Sense",
+        4.0: "Scientific Information",
+        9.0: "Don't Know"
+    },
+    filename="right_and_wrong.csv",
+    full_text="When it comes to questions of right and wrong, which of the following do you look to most for guidance?")
+
+SCRIPTURE = Question(
+    title="The Holy Book for My Religion is...",
+    question="qg7",
+    response_map={
+        1.0: "The Word of God",
+        2.0: "The Work of Men",
+        3.0: "Other",
+        9.0: "Don't Know"
+    },
+    filename="scripture.csv",
+    full_text="Which comes closest to your view: the holy book of my religion is...")
+
+# Every registered question, in the order in which they are presented
+QUESTIONS = [
+    BELIEVE_IN_GOD,
+    BELIEVE_IN_HEAVEN,
+    BELIEVE_IN_HELL,
+    RIGHT_AND_WRONG,
+    SCRIPTURE]
+
+# The columns of the primary dataset read by this script
+COLUMNS = [AGE_KEY] + [q.question for q in QUESTIONS]
 
 # -----------------------------------------------------------------------------
 # Generic Processor
 # -----------------------------------------------------------------------------
 
-def get_lower_bound(df, age):
-  while age not in df["Age"].values:
-    age = age - 1
-  return age
-
-def get_upper_bound(df, age):
-  while age not in df["Age"].values:
-    age = age + 1
-  return age
+def count_responses(df, question):
+    """
+    :param df The input dataframe
+    :param question The original question number label
+    :return The number of respondents giving each response, by age label
+    """
+    return survey.count_pairs(df, AGE_KEY, question)
 
 def processor(df, question, response_map):
     """
@@ -154,100 +154,80 @@ def processor(df, question, response_map):
     :param response_map The dictionary that maps the 
     response labels in input dataframe to readable labels
     """
+    return processor_from_counts(count_responses(df, question), response_map)
+
+def processor_from_counts(counts, response_map):
+    """
+    :param counts The number of respondents giving each response, 
+    by age label, as from count_responses or survey.stream_counts
+    :param response_map The dictionary that maps the 
+    response labels in input dataframe to readable labels
+    """
 
-    # Prepare the dataframe with known values
-    prep = pd.DataFrame()
-    for age_key in AGE_MAP.keys():
-        # Isolate the age we care about
-        tmp = df[df[AGE_KEY] == age_key]
-
-        # Compute the proportions for that age
-        props = [AGE_MAP[age_key]]
-        for response_key in response_map:
-            prop = len(tmp[tmp[question] == response_key]) / len(tmp)
-            props.append(prop)
-
-        prep = prep.append(pd.DataFrame(np.matrix(props)))
-
-    # Setup the columns for the processed dataframe
-    columns = ["Age"]
-    columns.extend(response_map.values())
-    prep.columns = columns
-
-    # Now, perform interpolation
-    for age in range(MIN_AGE, MAX_AGE):
-        if age not in prep["Age"].values:
-            lower_bound_x = get_lower_bound(prep, age)
-            upper_bound_x = get_upper_bound(prep, age)
-
-            columns = [age]
-            for response in filter(lambda x: x != "Age", prep.columns):
-                lower_bound_y = prep[prep["Age"] == lower_bound_x].iloc[0][response]
-                upper_bound_y = prep[prep["Age"] == upper_bound_x].iloc[0][response]
-
-                # Perform the interpolation
-                interpolated = np.interp(age, [lower_bound_x, upper_bound_x], [lower_bound_y, upper_bound_y])
-                columns.append(interpolated)
-            
-            tmp = pd.DataFrame(np.matrix(columns))
-            tmp.columns = prep.columns
-            prep = prep.append(tmp)
-    
-    # Sort the values
-    prep["Age"] = prep["Age"].astype(int)
-    prep.sort_values(by="Age", inplace=True)
+    # Compute the proportions for every known age at once; the
+    # totals include respondents who did not answer the question
+    known = counts.loc[list(AGE_MAP.keys())]
+    totals = known.sum(axis=1).to_numpy()
+    known = known.reindex(columns=list(response_map.keys()), fill_value=0)
+    props = known.to_numpy() / totals[:, np.newaxis]
+
+    # Order the known points by age for interpolation
+    ages = np.array(list(AGE_MAP.values()))
+    order = np.argsort(ages)
+    ages = ages[order]
+    props = props[order]
+
+    # Now, perform interpolation over the full range of ages
+    grid = np.arange(MIN_AGE, MAX_AGE + 1)
+    prep = pd.DataFrame({"Age": grid})
+    for i, response in enumerate(response_map.values()):
+        prep[response] = np.interp(grid, ages, props[:, i])
 
     # Return the prepared dataframe
     return prep
 
 # -----------------------------------------------------------------------------
-# Believe in God
-# -----------------------------------------------------------------------------
-
-def process_believe_god(df):
-    print("[+] Processing 'believe in god'...")
-    prepped = processor(df, BELIEVE_IN_GOD_Q, BELIEVE_IN_GOD_RESPONSE_MAP)
-    prepped.to_csv(DATA_PATH + BELIEVE_IN_GOD_FILENAME)
-    print("[+] Done!")
-
-# -----------------------------------------------------------------------------
-# Believe in Heaven
-# -----------------------------------------------------------------------------
-
-def process_believe_heaven(df):
-    print("[+] Processing 'believe in heaven'...")
-    prepped = processor(df, BELIEVE_IN_HEAVEN_Q, BELIEVE_IN_HEAVEN_RESPONSE_MAP)
-    prepped.to_csv(DATA_PATH + BELIEVE_IN_HEAVEN_FILENAME)
-    print("[+] Done!")
-
-# -----------------------------------------------------------------------------
-# Believe in Hell
+# Engine
 # -----------------------------------------------------------------------------
 
-def process_believe_hell(df):
-    print("[+] Processing 'believe in hell'...")
-    prepped = processor(df, BELIEVE_IN_HELL_Q, BELIEVE_IN_HELL_RESPONSE_MAP)
-    prepped.to_csv(DATA_PATH + BELIEVE_IN_HELL_FILENAME)
-    print("[+] Done!")
-
-# -----------------------------------------------------------------------------
-# Right and Wrong
-# -----------------------------------------------------------------------------
-
-def process_right_and_wrong(df):
-    print("[+] Processing 'right and wrong'...")
-    prepped = processor(df, RIGHT_AND_WRONG_Q, RIGHT_AND_WRONG_RESPONSE_MAP)
-    prepped.to_csv(DATA_PATH + RIGHT_AND_WRONG_FILENAME)
-    print("[+] Done!")
+def count_all_responses(df, questions=QUESTIONS):
+    """
+    :param df The input dataframe
+    :param questions The questions to count
+    :return Map question number label -> the number of respondents giving
+    each response, by age label, all from a single group-by on age
+    """
+    grouped = df.groupby(AGE_KEY)
+    counts = {}
+    for q in questions:
+        # Nullable (compact) columns give nullable counts; keep plain integers
+        responses = grouped[q.question].value_counts(dropna=False)
+        counts[q.question] = responses.unstack(fill_value=0).astype(np.int64)
+    return counts
+
+def stream_all_responses(questions=QUESTIONS):
+    """
+    :param questions The questions to count
+    :return The counts, as from count_all_responses, accumulated over 
+    the survey one chunk at a time so that it is never fully loaded
+    """
+    columns = [AGE_KEY] + [q.question for q in questions]
 
-# -----------------------------------------------------------------------------
-# Scripture
-# -----------------------------------------------------------------------------
+    totals = {}
+    for chunk in survey.read_chunks(columns):
+        for question, counts in count_all_responses(chunk, questions).items():
+            totals[question] = survey.add_counts(totals.get(question), counts)
+    return totals
 
-def process_right_and_wrong(df):
-    print("[+] Processing 'scripture'...")
-    prepped = processor(df, SCRIPTURE_Q, SCRIPTURE_RESPONSE_MAP)
-    prepped.to_csv(DATA_PATH + SCRIPTURE_FILENAME)
+def process_all(counts, questions=QUESTIONS):
+    """
+    :param counts The counts, as from count_all_responses
+    :param questions The questions to process
+    """
+    for q in questions:
+        print("[+] Processing '{}'...".format(q.title))
+        prepped = processor_from_counts(counts[q.question], q.response_map)
+        prepped.to_csv(DATA_PATH + q.filename)
     print("[+] Done!")
 
 # -----------------------------------------------------------------------------
@@ -255,11 +235,7 @@ def process_right_and_wrong(df):
 # -----------------------------------------------------------------------------
 
 def main():
-    df = pd.read_spss(DATA_FILE, convert_categoricals=False)
-    process_believe_god(df)
-    process_believe_heaven(df)
-    process_believe_hell(df)
-    process_right_and_wrong(df)
+    process_all(stream_all_responses())
 
 # -----------------------------------------------------------------------------
 # Script Entry Point
@@ -9,12 +9,17 @@
 # This code is adapted from the work by Leah Libresco:
 # https://github.com/fivethirtyeight/data/tree/master/pew-religions
 
+import operator
+
 import numpy as np
 import pandas as pd
 
 # The name of the output file
 FILENAME = "patterns.csv"
 
+# The name of the output file for the scenario bands
+BANDS_FILENAME = "future_bands.csv"
+
 # Current and projected US population
 US_POPULATION_2020 = 300000000
 US_POPULATION_2120 = 550000000
@@ -40,8 +45,30 @@ FUTURE_TRANSFORMED_COLUMN_HEADERS = [
     "Religion",
     "Count"]
 
+# The df column headers for the scenario bands
+FUTURE_BANDS_COLUMN_HEADERS = [
+    "Year",
+    "Religion",
+    "Low",
+    "Median",
+    "High"]
+
+# The percentiles reported as the low, median and high bands
+PERCENTILES = (5, 50, 95)
+
+# The number of scenarios sampled for the bands
+SCENARIOS = 10000
+
+# The spread of the (lognormal) perturbations applied 
+# to each transition rate and fertility rate in a scenario
+TRANSITION_SPREAD = 0.1
+FERTILITY_SPREAD = 0.05
+
+# The seed for sampling scenarios, so that the bands are reproducible
+SEED = 2021
+
 # The religions ransition matrix 
-TRANSITION_MATRIX = np.matrix(((0.390296314, 0.027141947, 0.06791021, 0.001857564, 0, 0, 0.011166082, 0.059762879, 0, 0, 0, 0.396569533),
+TRANSITION_MATRIX = np.array(((0.390296314, 0.027141947, 0.06791021, 0.001857564, 0, 0, 0.011166082, 0.059762879, 0, 0, 0, 0.396569533),
                 (0.005370791, 0.593173325, 0.103151608, 0.000649759, 0.010486747, 0.005563864, 0.002041424, 0.053825329, 0.004760476, 0.001130529, 0.000884429, 0.199488989),
                 (0.00371836, 0.023900817, 0.650773331, 0.000250102, 0.016774503, 0.003098214, 0.001865491, 0.122807467, 0.004203107, 0.000186572, 0.002123778, 0.151866648),
                 (0, 0, 0.0033732, 0.804072618, 0, 0.001511151, 0, 0.01234639, 0, 0.00209748, 0, 0.17659916),
@@ -55,42 +82,157 @@ TRANSITION_MATRIX = np.matrix(((0.390296314, 0.027141947, 0.06791021, 0.00185756
                 (0.006438308, 0.044866331, 0.1928814, 0.002035375, 0.04295005, 0.010833621, 0.011541439, 0.09457963, 0.01365141, 0.005884336, 0.002892072, 0.525359211)))
 
 # The fertility array
-FERTILITY_ARRAY = np.matrix(((2.1, 2.3, 2.3, 2.1, 2.5, 2.1, 2, 1.9, 3.4, 2.8, 2.1, 1.7)))
-
-def generate_input_data():
-    # Initial distribution of religions in US
-    first = np.matrix([.007, .208, .254, .007, .065, .008, .019, .147, .016, .009, .005, .228])
-
-    # Normalize to sum to 100%
-    current = first / np.sum(first)
-
-    df = pd.DataFrame()
-    for _ in range(0, 100):            
-        # Apply transition matrix to current distribution
-        current = current * TRANSITION_MATRIX
-        
-        # Divide by two for couple number
-        current = current / 2
-        
-        # Adjust by fertility
-        current = np.multiply(FERTILITY_ARRAY, current)
-        
-        # Normalize to 100%
-        current = current / np.sum(current)
-
-        df = df.append(pd.DataFrame(current), ignore_index=True)
-
-    df.columns = FUTURE_COLUMN_HEADERS
-    return df
+FERTILITY_ARRAY = np.array((2.1, 2.3, 2.3, 2.1, 2.5, 2.1, 2, 1.9, 3.4, 2.8, 2.1, 1.7))
+
+# Initial distribution of religions in US
+INITIAL_DISTRIBUTION = np.array((.007, .208, .254, .007, .065, .008, .019, .147, .016, .009, .005, .228))
+
+# The number of years to project
+YEARS = 100
+
+def normalize(current):
+    # Normalize each distribution (row) to sum to 100%
+    return current / np.sum(current, axis=-1, keepdims=True)
+
+def step(current, transition=TRANSITION_MATRIX, fertility=FERTILITY_ARRAY):
+    # Apply transition matrix to current distribution(s)
+    current = current @ transition
+    
+    # Divide by two for couple number
+    current = current / 2
+    
+    # Adjust by fertility
+    current = current * fertility
+    
+    # Normalize to 100%
+    return normalize(current)
+
+def step_matrix(transition=TRANSITION_MATRIX, fertility=FERTILITY_ARRAY):
+    # Up to the normalization, one step is a single linear map, 
+    # which lets us jump ahead by taking powers of its matrix
+    return transition / 2 * fertility
+
+def matrix_powers(matrix, count):
+    # Precompute matrix^(2^i) for i < count by repeated squaring; 
+    # each power is rescaled to keep it from overflowing, which is
+    # harmless because every projection is normalized afterwards
+    powers = np.empty((count,) + matrix.shape)
+    power = matrix / matrix.max()
+    for i in range(count):
+        powers[i] = power
+        power = power @ power
+        power = power / power.max()
+    return powers
+
+def project(starts, horizon, powers=None):
+    """
+    :param starts A starting distribution, or an array of them (one per row)
+    :param horizon The number of years to project ahead
+    :param powers The matrix powers from matrix_powers, which must 
+    cover horizon.bit_length() powers; computed if not given
+    :return The distribution(s) after horizon years, computed without 
+    stepping through the intervening years
+    """
+    # Horizons often come from arrays, as NumPy integers
+    horizon = operator.index(horizon)
+    if powers is None:
+        powers = matrix_powers(step_matrix(), max(horizon.bit_length(), 1))
+
+    current = normalize(np.atleast_2d(starts))
+    for i in range(horizon.bit_length()):
+        if (horizon >> i) & 1:
+            current = normalize(current @ powers[i])
+    return current if np.ndim(starts) > 1 else current[0]
+
+def project_trajectory(starts, years=YEARS):
+    """
+    :param starts A starting distribution, or an array of them (one per row)
+    :param years The number of years to project
+    :return An array with the distribution(s) in each year, indexed 
+    first by year; entry 0 is the projection one year ahead
+    """
+    current = normalize(np.atleast_2d(starts))
+    trajectory = np.empty((years,) + current.shape)
+    for year in range(years):
+        current = step(current)
+        trajectory[year] = current
+    return trajectory if np.ndim(starts) > 1 else trajectory[:, 0]
+
+def generate_input_data(years=YEARS):
+    trajectory = project_trajectory(INITIAL_DISTRIBUTION, years)
+    return pd.DataFrame(trajectory, columns=FUTURE_COLUMN_HEADERS)
+
+def project_population(years=YEARS):
+    # A linear ramp from the current to the projected population,
+    # continued at the same rate beyond the projected year
+    growth = (US_POPULATION_2120 - US_POPULATION_2020) / (YEARS - 1)
+    return np.linspace(US_POPULATION_2020, US_POPULATION_2020 + growth*(years - 1), years)
 
 def transform_input_data(df):
-    new = pd.DataFrame()    
-    pop = np.linspace(US_POPULATION_2020, US_POPULATION_2120, 100)
-    for year, _ in enumerate(df.iterrows()):
-        for label in FUTURE_COLUMN_HEADERS:
-            new = new.append(pd.DataFrame(np.matrix([year, label, np.int64(df.iloc[year][label]*pop[year])])))
-    new.columns = FUTURE_TRANSFORMED_COLUMN_HEADERS
-    return new
+    # Scale every year's proportions by that year's population at once
+    pop = project_population(len(df))
+    counts = (df[FUTURE_COLUMN_HEADERS].to_numpy() * pop[:, np.newaxis]).astype(np.int64)
+
+    # Reshape into one (Year, Religion, Count) row per cell
+    years, religions = counts.shape
+    return pd.DataFrame({
+        "Year": np.repeat(np.arange(years), religions),
+        "Religion": np.tile(FUTURE_COLUMN_HEADERS, years),
+        "Count": counts.ravel()
+    }, columns=FUTURE_TRANSFORMED_COLUMN_HEADERS)
+
+def sample_scenarios(count=SCENARIOS, seed=SEED):
+    """
+    :param count The number of scenarios to sample
+    :param seed The seed for the random number generator
+    :return The transition matrices and fertility arrays of the scenarios,
+    stacked along the first axis
+    """
+    rng = np.random.default_rng(seed)
+
+    # Perturb every transition rate and rescale each row back to its sum in 
+    # the base matrix (which need not be one), so that only the split of each 
+    # religion between destinations varies; transitions that never happen stay at zero
+    transitions = TRANSITION_MATRIX * rng.lognormal(0, TRANSITION_SPREAD, (count,) + TRANSITION_MATRIX.shape)
+    transitions = transitions * (
+        np.sum(TRANSITION_MATRIX, axis=-1, keepdims=True) / np.sum(transitions, axis=-1, keepdims=True))
+
+    fertilities = FERTILITY_ARRAY * rng.lognormal(0, FERTILITY_SPREAD, (count, FERTILITY_ARRAY.size))
+    return transitions, fertilities
+
+def project_scenarios(transitions, fertilities, years=YEARS):
+    """
+    :param transitions The transition matrix of each scenario
+    :param fertilities The fertility array of each scenario
+    :param years The number of years to project
+    :return An array with the distribution in each year (first index) 
+    for each scenario (second index)
+    """
+    # One step matrix per scenario, all stepped together
+    matrices = step_matrix(transitions, fertilities[:, np.newaxis, :])
+    current = np.tile(normalize(INITIAL_DISTRIBUTION), (len(matrices), 1))
+
+    trajectory = np.empty((years,) + current.shape)
+    for year in range(years):
+        current = normalize(np.matmul(current[:, np.newaxis, :], matrices)[:, 0])
+        trajectory[year] = current
+    return trajectory
+
+def compute_bands(trajectory):
+    """
+    :param trajectory The scenarios, as from project_scenarios
+    :return The (Year, Religion, Low, Median, High) table of adherent counts
+    """
+    bands = np.percentile(trajectory, PERCENTILES, axis=1)
+    bands = bands * project_population(len(trajectory))[:, np.newaxis]
+
+    years, religions = bands.shape[1:]
+    columns = {
+        "Year": np.repeat(np.arange(years), religions),
+        "Religion": np.tile(FUTURE_COLUMN_HEADERS, years)}
+    for header, band in zip(FUTURE_BANDS_COLUMN_HEADERS[2:], bands):
+        columns[header] = band.astype(np.int64).ravel()
+    return pd.DataFrame(columns, columns=FUTURE_BANDS_COLUMN_HEADERS)
 
 def main():
     print("Generating...")
@@ -102,6 +244,12 @@ def main():
     print("Writing...")
     df.to_csv("future.csv")
 
+    print("Sampling {} scenarios...".format(SCENARIOS))
+    trajectory = project_scenarios(*sample_scenarios())
+
+    print("Writing bands...")
+    compute_bands(trajectory).to_csv(BANDS_FILENAME)
+
     print("Done!")
 
 if __name__ == "__main__":
@@ -0,0 +1,293 @@
+# geography.py
+#
+# Preprocessing for the map in the 'geography' chapter.
+#
+# The US atlas published with vega-datasets (us-10m) carries the
+# county, state and land geometry at full resolution. The map only
+# draws states, so we reduce it once to a state-level topology:
+# the county and land objects are dropped along with every arc that
+# only they use, each remaining arc is simplified, and the result
+# is quantized onto a coarser grid. Rings that would collapse or flip
+# on that grid, a handful of small and narrow islands, are dropped. The
+# app inlines the reduced file into the chart so that the map never
+# fetches anything remotely.
+#
+# Arcs are simplified independently, with their endpoints fixed, so
+# neighbouring states still share identical borders.
+#
+#   python geography.py [source] [factor]
+#
+# The source defaults to the published atlas. A copy of the same atlas
+# quantized onto a finer grid needs a larger factor to reach the same
+# output grid; e.g. bqplot's map_data/USCountiesMap.json, which is the
+# 10m atlas on a grid ten times finer, is reduced with a factor of 100.
+
+import json
+import sys
+
+import numpy as np
+
+# -----------------------------------------------------------------------------
+# General Constants
+# -----------------------------------------------------------------------------
+
+# The relative path to the data directory
+DATA_PATH = "data/"
+
+# The published atlas from which the state topology is derived
+US_ATLAS_URL = "https://cdn.jsdelivr.net/npm/vega-datasets@v1.29.0/data/us-10m.json"
+
+# The location of the reduced state topology
+STATES_TOPOLOGY_PATH = DATA_PATH + "us_states.json"
+
+# The object of the atlas that holds the state geometry
+STATES_OBJECT = "states"
+
+# The number of grid steps per unit of the input grid
+# that are merged into one step of the output grid
+QUANTIZATION_FACTOR = 10
+
+# The simplification tolerance, in steps of the output grid
+TOLERANCE = 2.0
+
+# -----------------------------------------------------------------------------
+# Arcs
+# -----------------------------------------------------------------------------
+
+def arc_indices(arcs):
+    """
+    :param arcs The (nested) arc references of a geometry
+    :return An iterator over the referenced arc indices;
+    a negative reference ~i denotes arc i reversed
+    """
+    if isinstance(arcs, int):
+        yield arcs if arcs >= 0 else ~arcs
+        return
+    for item in arcs:
+        yield from arc_indices(item)
+
+def remap_arcs(arcs, mapping):
+    """
+    :param arcs The (nested) arc references of a geometry
+    :param mapping Map old arc index -> new arc index
+    :return The arc references, renumbered
+    """
+    if isinstance(arcs, int):
+        return mapping[arcs] if arcs >= 0 else ~mapping[~arcs]
+    return [remap_arcs(item, mapping) for item in arcs]
+
+def decode_arc(arc):
+    """
+    :param arc A delta-encoded arc of a quantized topology
+    :return The absolute grid positions of its points
+    """
+    return np.cumsum(np.array(arc, dtype=np.int64), axis=0)
+
+def encode_arc(points):
+    """
+    :param points The absolute grid positions of an arc
+    :return The delta-encoded arc
+    """
+    return np.diff(points, axis=0, prepend=np.zeros((1, 2), dtype=np.int64)).tolist()
+
+# -----------------------------------------------------------------------------
+# Simplification
+# -----------------------------------------------------------------------------
+
+def douglas_peucker(points, tolerance, anchors=()):
+    """
+    :param points The points of a polyline
+    :param tolerance The greatest distance by which a point may be moved
+    :param anchors The indices of further points that must be kept
+    :return A mask of the points kept; the endpoints are always kept
+    """
+    keep = np.zeros(len(points), dtype=bool)
+    keep[[0, -1]] = True
+    keep[list(anchors)] = True
+
+    kept = np.flatnonzero(keep)
+    stack = list(zip(kept[:-1], kept[1:]))
+    while stack:
+        first, last = stack.pop()
+        if last - first < 2:
+            continue
+
+        # Distance of every intermediate point from the chord
+        start = points[first].astype(np.float64)
+        chord = points[last] - start
+        offsets = points[first + 1:last] - start
+        length = np.hypot(*chord)
+        if length == 0:
+            distances = np.hypot(offsets[:, 0], offsets[:, 1])
+        else:
+            distances = np.abs(chord[0]*offsets[:, 1] - chord[1]*offsets[:, 0]) / length
+
+        farthest = int(np.argmax(distances))
+        if distances[farthest] > tolerance:
+            split = first + 1 + farthest
+            keep[split] = True
+            stack.append((first, split))
+            stack.append((split, last))
+    return keep
+
+def simplify_arc(points, tolerance):
+    """
+    :param points The absolute positions of an arc
+    :param tolerance The greatest distance by which a point may be moved
+    :return The positions of the simplified arc
+    """
+    # A closed arc is a whole ring by itself; anchoring it at
+    # thirds keeps it from collapsing to a line
+    anchors = ()
+    if len(points) > 3 and (points[0] == points[-1]).all():
+        anchors = (len(points) // 3, 2*len(points) // 3)
+    return points[douglas_peucker(points, tolerance, anchors)]
+
+def quantize_arc(points, factor):
+    """
+    :param points The absolute positions of an arc on the input grid
+    :param factor The number of input grid steps per output grid step
+    :return The absolute positions on the output grid, without
+    consecutive duplicates; the endpoints are always kept
+    """
+    points = np.round(points / factor).astype(np.int64)
+    moved = np.any(points[1:] != points[:-1], axis=1)
+    keep = np.concatenate([[True], moved])
+    keep[-1] = True
+    return points[keep]
+
+# -----------------------------------------------------------------------------
+# Rings
+# -----------------------------------------------------------------------------
+
+def ring_points(ring, arcs):
+    """
+    :param ring The arc references of a ring
+    :param arcs Map arc index -> the absolute positions of the arc
+    :return The absolute positions of the ring, from the first point
+    back to the first point
+    """
+    parts = [arcs[i] if i >= 0 else arcs[~i][::-1] for i in ring]
+    return np.concatenate([parts[0]] + [part[1:] for part in parts[1:]])
+
+def ring_area(points):
+    """
+    :param points The absolute positions of a ring
+    :return The signed area of the ring; negative if clockwise
+    """
+    x, y = points[:, 0].astype(np.float64), points[:, 1].astype(np.float64)
+    return 0.5*np.sum(x[:-1]*y[1:] - x[1:]*y[:-1])
+
+def keeps_orientation(ring, before, after):
+    """
+    :param ring The arc references of a ring
+    :param before Map arc index -> the positions of the arc before reduction
+    :param after Map arc index -> the positions of the arc after reduction
+    :return Whether the reduced ring still winds the same way; a ring that
+    collapses or flips would be drawn by the browser as covering the globe
+    """
+    return np.sign(ring_area(ring_points(ring, before))) == np.sign(ring_area(ring_points(ring, after)))
+
+def reduce_geometry(geometry, before, after):
+    """
+    :param geometry A geometry of the topology
+    :param before Map arc index -> the positions of the arc before reduction
+    :param after Map arc index -> the positions of the arc after reduction
+    :return The geometry without the rings that do not survive the reduction;
+    a polygon whose exterior ring does not survive is dropped with its holes,
+    and a geometry left without polygons becomes a null geometry
+    """
+    if geometry.get("type") == "Polygon":
+        polygons = [geometry["arcs"]]
+    elif geometry.get("type") == "MultiPolygon":
+        polygons = geometry["arcs"]
+    else:
+        return geometry
+
+    polygons = [
+        [ring for ring in polygon if keeps_orientation(ring, before, after)]
+        for polygon in polygons if keeps_orientation(polygon[0], before, after)]
+
+    if not polygons:
+        null = {key: value for key, value in geometry.items() if key != "arcs"}
+        null["type"] = None
+        return null
+    if geometry["type"] == "Polygon":
+        return dict(geometry, arcs=polygons[0])
+    return dict(geometry, arcs=polygons)
+
+# -----------------------------------------------------------------------------
+# Engine
+# -----------------------------------------------------------------------------
+
+def reduce_topology(topology, name=STATES_OBJECT, factor=QUANTIZATION_FACTOR, tolerance=TOLERANCE):
+    """
+    :param topology A quantized TopoJSON topology
+    :param name The object to keep
+    :param factor The number of input grid steps per output grid step
+    :param tolerance The simplification tolerance, in output grid steps
+    :return A topology holding only the named object and its arcs,
+    simplified and quantized onto the coarser grid
+    """
+    geometries = topology["objects"][name]
+    referenced = {i for g in geometries["geometries"] for i in arc_indices(g.get("arcs", []))}
+
+    before = {i: decode_arc(topology["arcs"][i]) for i in referenced}
+    after = {i: quantize_arc(simplify_arc(before[i], tolerance*factor), factor) for i in referenced}
+    kept = [reduce_geometry(g, before, after) for g in geometries["geometries"]]
+
+    used = sorted({i for g in kept for i in arc_indices(g.get("arcs", []))})
+    mapping = {old: new for new, old in enumerate(used)}
+
+    reduced = dict(geometries)
+    reduced["geometries"] = [
+        dict(g, arcs=remap_arcs(g["arcs"], mapping)) if "arcs" in g else g
+        for g in kept]
+
+    transform = topology["transform"]
+    return {
+        "type": "Topology",
+        "transform": {
+            "scale": [s*factor for s in transform["scale"]],
+            "translate": transform["translate"]
+        },
+        "objects": {name: reduced},
+        "arcs": [encode_arc(after[i]) for i in used]
+    }
+
+def read_topology(source):
+    """
+    :param source The path or URL of a TopoJSON file
+    :return The parsed topology
+    """
+    if source.startswith(("http://", "https://")):
+        from urllib.request import urlopen
+        with urlopen(source) as response:
+            return json.load(response)
+    with open(source) as f:
+        return json.load(f)
+
+# -----------------------------------------------------------------------------
+# Main
+# -----------------------------------------------------------------------------
+
+def main():
+    source = sys.argv[1] if len(sys.argv) > 1 else US_ATLAS_URL
+    factor = int(sys.argv[2]) if len(sys.argv) > 2 else QUANTIZATION_FACTOR
+    print("[+] Reading '{}'...".format(source))
+    topology = read_topology(source)
+
+    print("[+] Reducing to '{}'...".format(STATES_OBJECT))
+    reduced = reduce_topology(topology, factor=factor)
+
+    with open(STATES_TOPOLOGY_PATH, "w") as f:
+        json.dump(reduced, f, separators=(",", ":"))
+    print("[+] Wrote {} arcs to '{}'".format(len(reduced["arcs"]), STATES_TOPOLOGY_PATH))
+    print("[+] Done!")
+
+# -----------------------------------------------------------------------------
+# Script Entry Point
+# -----------------------------------------------------------------------------
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,103 @@
+# prewarm.py
+#
+# Prepares the application before it serves its first visitor.
+#
+# A deploy script starts the application with the script health check
+# enabled and runs this once it has started:
+#
+#   streamlit run streamlit_app.py --server.scriptHealthCheckEnabled=true
+#   python prewarm.py http://localhost:8501
+#
+# It converts the primary dataset ahead of time and then asks the
+# server to run the application once. That run happens in the server
+# process itself, so it imports every module and fills the caches
+# shared by all sessions (the datasets, the aggregates and the chart
+# specs for the default view); the first visitor then gets a warm run.
+#
+# The server runs the application on request only when started with
+# server.scriptHealthCheckEnabled (or STREAMLIT_SERVER_SCRIPT_HEALTH_CHECK_ENABLED).
+# The repository leaves it off: the route is unauthenticated and every
+# request to it runs the whole application, so a deployment opts in only
+# where the route is not exposed. Without a URL, only the primary dataset
+# is converted.
+
+import sys
+import time
+from urllib.error import HTTPError, URLError
+from urllib.request import urlopen
+
+import survey
+
+# -----------------------------------------------------------------------------
+# General Constants
+# -----------------------------------------------------------------------------
+
+# The route at which the server runs the application once
+SCRIPT_HEALTH_CHECK_ROUTE = "/_stcore/script-health-check"
+
+# The error when the server does not run the application on request
+NOT_ENABLED = ("The server does not run the application on request; "
+               "start it with --server.scriptHealthCheckEnabled=true")
+
+# The number of seconds to wait for the run of the application
+TIMEOUT = 300
+
+# The number of seconds to wait for the server to start
+STARTUP_TIMEOUT = 60
+
+# -----------------------------------------------------------------------------
+# Prewarm
+# -----------------------------------------------------------------------------
+
+def prepare_primary_data():
+    if survey.is_cache_fresh():
+        print("[+] '{}' is up to date".format(survey.PRIMARY_CACHE_PATH))
+        return
+    print("[+] Converting '{}'...".format(survey.PRIMARY_DATA_PATH))
+    survey.convert_primary_data()
+
+def warm_server(url):
+    """
+    :param url The base URL of the running application
+    :return The number of seconds the run of the application took
+    """
+    route = url.rstrip("/") + SCRIPT_HEALTH_CHECK_ROUTE
+    deadline = time.monotonic() + STARTUP_TIMEOUT
+    while True:
+        start = time.perf_counter()
+        try:
+            with urlopen(route, timeout=TIMEOUT) as response:
+                response.read()
+                # Without the check, the route is served the page of the
+                # application (or not found) instead of the result of a run
+                if response.headers.get_content_type() != "text/plain":
+                    raise RuntimeError(NOT_ENABLED)
+            return time.perf_counter() - start
+        except HTTPError as e:
+            if e.code == 404:
+                raise RuntimeError(NOT_ENABLED) from e
+            # The application ran, but raised an exception
+            raise RuntimeError(e.read().decode()) from e
+        except URLError:
+            # The server may still be starting
+            if time.monotonic() > deadline:
+                raise
+            time.sleep(1)
+
+# -----------------------------------------------------------------------------
+# Main
+# -----------------------------------------------------------------------------
+
+def main():
+    prepare_primary_data()
+    if len(sys.argv) > 1:
+        print("[+] Running the application at '{}'...".format(sys.argv[1]))
+        print("[+] Took {:.2f}s".format(warm_server(sys.argv[1])))
+    print("[+] Done!")
+
+# -----------------------------------------------------------------------------
+# Script Entry Point
+# -----------------------------------------------------------------------------
+
+if __name__ == "__main__":
+    main()
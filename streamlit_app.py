@@ -3,11 +3,21 @@
 #
 # Abby Vorhaus, Kyle Dotterrer
 
+import functools
+import os
+
 import numpy as np
 import pandas as pd
-import altair as alt
 import streamlit as st
-from vega_datasets import data
+
+import chartcache
+import evolution
+import geography
+import survey
+import timing
+
+# Altair is imported by the functions that build charts, so that on
+# a cold start the introduction is on screen while altair is loading
 
 # The relative path to the directory in which data is stored
 DATA_PATH = "data/"
@@ -16,9 +26,6 @@ DATA_PATH = "data/"
 # Primary Dataset
 # -----------------------------------------------------------------------------
 
-# The relative path to the primary dataset
-PRIMARY_DATA_PATH  = DATA_PATH + "data.sav"
-
 # The default height for our visualizations
 DEFAULT_WIDTH = 800
 
@@ -28,12 +35,31 @@ DEFAULT_HEIGHT = 550
 # Colors from Vega color scheme for charts that should not be scaled
 COLOR_SCHEME_BLUE = "#90c1dc"
 
+# The number of finished chart specs kept, across all sessions
+CHART_CACHE_SIZE = 64
+
+# If set, the path to which the timings are exported after every run, as
+# JSON lines (for a .jsonl path) or in the Prometheus text format
+METRICS_PATH = os.environ.get("METRICS_PATH")
+
 st.set_page_config(layout="wide")
 
 # -----------------------------------------------------------------------------
 # Geography-Specific
 # -----------------------------------------------------------------------------
 
+# The columns of the primary dataset used in the 'geography' chapter
+GEOGRAPHY_COLUMNS = ["qe1", "state"]
+
+# The religion codes that are left out of the analysis
+DROPPED_RELIGION_CODES = [
+    21.0, 22.0, 23.0, 24.0, 25.0, 30.0, 31.0, 32.0, 33.0, 34.0,
+    35.0, 36.0, 37.0, 38.0, 39.0, 43.0, 44.0, 45.0, 46.0, 50.0,
+    51.0, 52.0, 53.0, 54.0, 55.0, 56.0, 57.0, 59.0, 61.0, 62.0,
+    63.0, 64.0, 65.0, 70.0, 71.0, 72.0, 73.0, 74.0, 75.0, 76.0,
+    77.0, 78.0, 79.0, 81.0, 82.0, 83.0, 84.0, 85.0, 86.0, 88.0,
+    90.0, 94.0, 96.0, 994.0, 999.0]
+
 RELIGION_DICT = {
     1.0: "Protestant",
     2.0: "Roman Catholic",
@@ -164,39 +190,149 @@ regiondict = {
         "Hawaii"]
 }
 
+# -----------------------------------------------------------------------------
+# Connection-Specific
+# -----------------------------------------------------------------------------
+
+# Map the column in the primary dataset -> the belief it records
+BELIEF_DICT = {
+    "qe1":   "Religion",
+    "qb1a":  "Immigration",
+    "qb1b":  "Women in Workforce",
+    "qb1c":  "Children Out of Wedlock",
+    "qb2a":  "Homosexuality",
+    "qb2b":  "Government Aid",
+    "qb2c":  "Environmental Regulations",
+    "qb2d":  "Morality",
+    "qb20":  "Government Size",
+    "qb21":  "Abortion",
+    "qb22":  "Gay Marriage",
+    "qb30":  "Evolution",
+    "qb31":  "Guidance in Life",
+    "party": "Political Party"}
+
+# The columns of the primary dataset used in the 'connection' chapter
+CONNECTION_COLUMNS = list(BELIEF_DICT.keys())
+
+# The beliefs and issues compared across religions, in the order 
+# in which they are indexed in the belief cube
+BELIEF_ISSUES = [belief for belief in BELIEF_DICT.values() if belief != "Religion"]
+
+# The counts behind the 'geography' and 'connection' chapters, as 
+# name -> (row column, column column); aggregates.py streams the 
+# survey into these counts when it is too large to load
+COUNT_PAIRS = dict(
+    [("states", ("state", "qe1"))] + 
+    [(belief, ("qe1", column)) for column, belief in BELIEF_DICT.items() if belief != "Religion"])
+
+# Map response code -> response text, for each belief
+CHANGE_DICT = {
+    1.0: "Positive Change",
+    2.0:"Negative Change",
+    3.0:"No Change",
+    4.0:"Mixed Change",
+    9.0:"Unsure"}
+
+HOMOSEXUALITY_DICT = {
+    1.0: "Accepted by Society",
+    2.0: "Rejected by Society",
+    3.0: "Both Equally",
+    9.0: "Unsure"}
+
+GOVERNMENT_AID_DICT = {
+    1.0: "More Harm than Good",
+    2.0: "More Good than Harm",
+    3.0: "Both Equally",
+    9.0:"Unsure"}
+
+ENVIRONMENT_DICT = {
+    1.0: "Hurt the Economy",
+    2.0: "Worth the cost",
+    3.0: "Both Equally",
+    9.0:"Unsure"}
+
+MORALITY_DICT = {
+    1.0: "Situationally Dependent",
+    2.0: "Absolute Standards for Right and Wrong",
+    3.0: "Both Equally",
+    9.0: "Unsure"}
+
+GOVERNMENT_SIZE_DICT = {
+    1.0: "Small",
+    2.0: "Large",
+    3.0: "Depends",
+    9.0: "Unsure"}
+
+ABORTION_DICT = {
+    1.0: "Legal",
+    2.0: "Legal in Most Cases",
+    3.0: "Illegal in Most Cases",
+    4.0: "Illegal", 
+    9.0:"Unsure"}
+
+GAY_MARRIAGE_DICT = {
+    1.0: "Strongly favor",
+    2.0: "Favor",
+    3.0: "Oppose",
+    4.0: "Strongly Oppose",
+    9.0: "Unsure"}
+
+EVOLUTION_DICT = {
+    1.0: "Agree",
+    2.0: "Disagree",
+    9.0: "Unsure"}
+
+GUIDANCE_DICT = {
+    1.0: "Religious Teachings",
+    2.0: "Philosphy and Reason",
+    3.0: "Practical Experience",
+    4.0: "Scientific Information",
+    9.0: "Unsure"}
+
+PARTY_DICT = {
+    1.0: "Republican",
+    2.0: "Democrat",
+    3.0: "Independent", 
+    4.0: "No Preference",
+    5.0: "Other", 
+    9.0: "Unsure"}
+
+# Map belief -> the codebook used to label its responses
+BELIEF_RESPONSE_DICTS = {
+    "Religion": RELIGION_DICT, 
+    "Immigration" : CHANGE_DICT,
+    "Women in Workforce" : CHANGE_DICT, 
+    "Children Out of Wedlock" : CHANGE_DICT, 
+    "Homosexuality": HOMOSEXUALITY_DICT, 
+    "Government Aid": GOVERNMENT_AID_DICT,
+    "Environmental Regulations": ENVIRONMENT_DICT,
+    "Morality": MORALITY_DICT,
+    "Government Size": GOVERNMENT_SIZE_DICT, 
+    "Abortion": ABORTION_DICT,
+    "Gay Marriage": GAY_MARRIAGE_DICT,
+    "Evolution": EVOLUTION_DICT,
+    "Guidance in Life": GUIDANCE_DICT,
+    "Political Party": PARTY_DICT}
+
+# Map religion text -> religion code
+RELIGION_CODES = {label: int(code) for code, label in RELIGION_DICT.items()}
+
 # -----------------------------------------------------------------------------
 # Evolution-Specific
 # -----------------------------------------------------------------------------
 
-# For the datasets used in the 'evolution' chapter,
-# we load a dataset for each question of interest
-EVOLUTION_BELIEVE_GOD_PATH = DATA_PATH + "believe_god.csv"
-EVOLUTION_BELIEVE_HEAVEN_PATH = DATA_PATH + "believe_heaven.csv"
-EVOLUTION_BELIEVE_HELL_PATH = DATA_PATH + "believe_hell.csv"
-EVOLUTION_RIGHT_AND_WRONG_PATH = DATA_PATH + "right_and_wrong.csv"
-EVOLUTION_SCRIPTURE_PATH = DATA_PATH + "scripture.csv"
+# For the datasets used in the 'evolution' chapter, we load a dataset 
+# for each question of interest; the questions are registered in evolution.py
 
 # Map the question text to the path to the data for that question
-EVOLUTION_QUESTIONS = {
-    "Do You Believe in God?": EVOLUTION_BELIEVE_GOD_PATH,
-    "Do You Believe in Heaven?": EVOLUTION_BELIEVE_HEAVEN_PATH,
-    "Do You Believe in Hell?": EVOLUTION_BELIEVE_HELL_PATH,
-    "Where Do You Look for Guidance on Questions of Right and Wrong?": EVOLUTION_RIGHT_AND_WRONG_PATH,
-    "The Holy Book for My Religion is...": EVOLUTION_SCRIPTURE_PATH
-}
+EVOLUTION_QUESTIONS = {q.title: DATA_PATH + q.filename for q in evolution.QUESTIONS}
 
 # The full text of the questions
-EVOLUTION_FULL_QUESTIONS = {
-    "Do You Believe in God?": "Do you believe in God or a universal spirit?",
-    "Do You Believe in Heaven?": "Do you think there is a heaven, where people who have led good lives are eternally rewarded?",
-    "Do You Believe in Hell?": "Do you think there is a hell, where people who have led bad lives and die without being sorry are eternally punished?",
-    "Where Do You Look for Guidance on Questions of Right and Wrong?": "When it comes to questions of right and wrong, which of the following do you look to most for guidance?",
-    "The Holy Book for My Religion is...": "Which comes closest to your view: the holy book of my religion is..."
-}
+EVOLUTION_FULL_QUESTIONS = {q.title: q.full_text for q in evolution.QUESTIONS}
 
 # The minimum and maximum ages in the dataset
-MIN_AGE = 24
-MAX_AGE = 90
+MIN_AGE = evolution.MIN_AGE
+MAX_AGE = evolution.MAX_AGE
 
 # -----------------------------------------------------------------------------
 # Future-Specific
@@ -205,6 +341,9 @@ MAX_AGE = 90
 # The relative path to the patterns dataset
 FUTURE_DATA_PATH = DATA_PATH + "future.csv"
 
+# The relative path to the scenario bands dataset
+FUTURE_BANDS_DATA_PATH = DATA_PATH + "future_bands.csv"
+
 # The df column headers for patterns dataset
 FUTURE_COLUMN_HEADERS = [
     "Buddhist", 
@@ -230,27 +369,182 @@ FUTURE_TRANSFORMED_COLUMN_HEADERS = [
 # Data Loading
 # -----------------------------------------------------------------------------
 
-@st.cache 
-def load_primary_data():
-    return pd.read_spss(PRIMARY_DATA_PATH, convert_categoricals=False)
-
-# No caching because streamlit cannot recognize that the
-# underlying dataframe has changed if it is cached :(
+# Cached as a resource so that a single, read-only copy of each
+# projection of the survey is shared by every session in the process
+# rather than being hashed and copied per session
+@timing.timed
+@st.cache_resource(max_entries=8)
+def read_primary_data(columns, fingerprint):
+    # Reads only the requested columns from the columnar
+    # copy of the survey, rebuilding it first if it is stale
+    return survey.read_primary_data(columns)
+
+@timing.timed
+def load_primary_data(columns):
+    return read_primary_data(columns, survey.dataset_fingerprint())
+
+# Cached per version of the primary dataset; the counts streamed from
+# it stand in for the respondents of surveys too large to load
+@st.cache_resource(max_entries=2)
+def read_counts(fingerprint):
+    return survey.read_counts()
+
+# Cached per version of the primary dataset, so that the aggregate is
+# computed once rather than on every rerun
+@st.cache_data(max_entries=2)
+def load_state_religion(fingerprint):
+    if survey.are_counts_fresh():
+        counts = read_counts(fingerprint)["states"]
+        return prepare_states_from_counts(counts, RELIGION_DICT, STATE_DICT)
+    df = read_primary_data(GEOGRAPHY_COLUMNS, fingerprint)
+    return prepare_states(df, RELIGION_DICT, STATE_DICT)
+
+# Cached per version of the bundled topology, which is small enough
+# to be inlined into the map spec rather than fetched by the browser
+@st.cache_resource(max_entries=2)
+def read_states_topology(path, fingerprint):
+    return geography.read_topology(path)
+
+def states_topology_fingerprint():
+    path = geography.STATES_TOPOLOGY_PATH
+    return survey.file_fingerprint(path) if os.path.exists(path) else None
+
+def load_states_feature():
+    import altair as alt
+
+    topology = read_states_topology(geography.STATES_TOPOLOGY_PATH, states_topology_fingerprint())
+    return alt.Data(
+        values=topology, 
+        format=alt.TopoDataFormat(type="topojson", feature=geography.STATES_OBJECT))
+
+# Cached per version of the primary dataset, so that the respondents are
+# counted once and every comparison only slices the (read-only) result
+@st.cache_resource(max_entries=2)
+def load_belief_cube(fingerprint):
+    if survey.are_counts_fresh():
+        cube = create_belief_cube_from_counts(read_counts(fingerprint))
+    else:
+        bdf = create_belief_df(read_primary_data(CONNECTION_COLUMNS, fingerprint))
+        cube = create_belief_cube(bdf)
+    cube.flags.writeable = False
+    return cube
+
+# Cached as a resource keyed on the path, size and modification time of
+# the file, so reruns reuse the same read-only frame without reading the
+# disk, while edits to the file are still picked up without a restart.
+# The index written with each file holds only zeros, so it is replaced by a
+# RangeIndex and the raw data shows no column of zeros
+@st.cache_resource(max_entries=4*len(EVOLUTION_QUESTIONS))
+def read_evolution_data(path, fingerprint):
+    return survey.read_only(pd.read_csv(path, index_col=0).reset_index(drop=True))
+
+@timing.timed
 def load_evolution_data():
     frames = {}
     for question, path in EVOLUTION_QUESTIONS.items():
-        frames[question] = pd.read_csv(path)
+        frames[question] = read_evolution_data(path, survey.file_fingerprint(path))
     return frames
 
-@st.cache
-def load_future_data():
+# Cached per version of each file, the same version that keys its charts,
+# so that an edited file is read again rather than charted from a stale frame
+@timing.timed
+@st.cache_data(max_entries=2)
+def load_future_data(fingerprint):
     # Read the original data
     return pd.read_csv(FUTURE_DATA_PATH)
 
+@st.cache_data(max_entries=2)
+def load_future_bands_data(fingerprint):
+    # Read the precomputed scenario bands
+    return pd.read_csv(FUTURE_BANDS_DATA_PATH, index_col=0)
+
+# -----------------------------------------------------------------------------
+# Chart Specs
+# -----------------------------------------------------------------------------
+
+# One cache of finished specs, shared by every session
+@st.cache_resource
+def get_chart_cache():
+    return chartcache.ChartCache(CHART_CACHE_SIZE)
+
+def render_chart(kind, version, selections, build):
+    """
+    Render a chart, building and serializing it only if the 
+    same chart has not been rendered recently.
+
+    :param kind The name of the chart
+    :param version The version of the data the chart is built from
+    :param selections The (hashable) widget values the chart depends on
+    :param build A function that builds the Altair chart
+    """
+    def build_spec():
+        # Time the construction of the chart apart from its serialization
+        with timing.span("chart.{}.build".format(kind)):
+            chart = build()
+        with timing.span("chart.{}.serialize".format(kind)):
+            return chart.to_dict()
+
+    key = (kind, version, selections)
+    spec = get_chart_cache().get(key, build_spec)
+    with timing.span("chart.{}.display".format(kind)):
+        st.vega_lite_chart(spec=spec)
+
+def render_diagnostics():
+    """
+    Render the optional diagnostics panel in the sidebar.
+    """
+    st.sidebar.subheader("Diagnostics")
+    if not st.sidebar.checkbox("Show Timings"):
+        return
+
+    st.sidebar.write(
+        "Time spent in each step, over the recent runs of every session " +
+        "(in milliseconds), and the use of the cache of finished charts.")
+
+    summary = pd.DataFrame(timing.TIMINGS.summary())
+    if not summary.empty:
+        summary = summary.set_index("span")
+        summary[["sum", "p50", "p95"]] *= 1000
+        st.sidebar.dataframe(summary.round(2))
+
+    stats = get_chart_cache().stats()
+    st.sidebar.write("Charts: {hits} hits, {misses} misses, {size} of {maxsize} kept".format(**stats))
+
+    st.sidebar.download_button(
+        "Export as JSON Lines", timing.to_jsonl(), file_name="timings.jsonl")
+    st.sidebar.download_button(
+        "Export for Prometheus", timing.to_prometheus(), file_name="timings.prom")
+
+def export_metrics():
+    if METRICS_PATH:
+        timing.write_metrics(METRICS_PATH)
+
+def chapter(render):
+    """
+    Make a chapter a fragment, so that interacting with the widgets in the
+    chapter reruns only that chapter. A rerun of the chapter alone never
+    reaches main, so it is timed as a span of its own, and exports the
+    timings itself.
+
+    :param render The function that renders the chapter
+    """
+    render = timing.timed(render)
+
+    @functools.wraps(render)
+    def wrapper(*args, **kwargs):
+        if timing.is_open("run"):
+            return render(*args, **kwargs)
+        with timing.span("rerun.{}".format(render.__name__)):
+            result = render(*args, **kwargs)
+        export_metrics()
+        return result
+    return st.fragment(wrapper)
+
 # -----------------------------------------------------------------------------
 # Top-Level
 # -----------------------------------------------------------------------------
 
+@timing.timed
 def render_introduction_content():
     """
     Render the introductory content.
@@ -276,6 +570,7 @@ def render_introduction_content():
         "but you can keep exploring! Below you will find options " + 
         "for each section that will allow you to explore the data.")
 
+@timing.timed
 def render_conclusion_content():
     """
     Render the conclusion content.
@@ -293,24 +588,24 @@ def render_conclusion_content():
 # Chapter: Geography
 # -----------------------------------------------------------------------------
 
+# Counts the respondents of each religion in each state
+def count_states(df):
+    return survey.count_pairs(df, "state", "qe1")
+
 # Prepares the Pandas dataframe for the US overlay chart
+@timing.timed
 def prepare_states(df, religiondict, statedict):
-    columnstodrop = [
-        21.0, 22.0, 23.0, 24.0, 25.0, 30.0, 31.0, 32.0, 33.0, 34.0,
-        35.0, 36.0, 37.0, 38.0, 39.0, 43.0, 44.0, 45.0, 46.0, 50.0,
-        51.0, 52.0, 53.0, 54.0, 55.0, 56.0, 57.0, 59.0, 61.0, 62.0,
-        63.0, 64.0, 65.0, 70.0, 71.0, 72.0, 73.0, 74.0, 75.0, 76.0,
-        77.0, 78.0, 79.0, 81.0, 82.0, 83.0, 84.0, 85.0, 86.0, 88.0,
-        90.0, 94.0, 96.0, 994.0, 999.0]
-    statesbase=df[["qe1"]].copy()
-    statebase = df[["state"]].copy()
-    
-    # Make Dummy variables so groupby works, format as needed
-    statesbase = pd.get_dummies(statesbase.qe1)
-    statesbase = statesbase.drop(columns = columnstodrop)
+    return prepare_states_from_counts(count_states(df), religiondict, statedict)
+
+# Prepares the Pandas dataframe for the US overlay chart from the counts
+# of each religion in each state, which may come from survey.stream_counts
+def prepare_states_from_counts(counts, religiondict, statedict):
+    # Format as needed
+    statesbase = survey.drop_unanswered(counts)
+    statesbase = statesbase.drop(columns = DROPPED_RELIGION_CODES)
     statesbase = statesbase.rename(columns = religiondict)
-    statesbase["State"] = statebase
-    statesbase = statesbase.groupby("State").sum()
+    statesbase.index.name = "State"
+    statesbase.columns.name = None
 
     # Percent breakdown by religions
     statesvreligion = statesbase.div(statesbase.sum(axis=1), axis=0) 
@@ -328,9 +623,12 @@ def prepare_states(df, religiondict, statedict):
     return statesvreligion
 
 # Build a heat map based on how religious each state in the US is
-def render_states_viz(statesvreligion):
-    states = alt.topo_feature(data.us_10m.url, "states")
-    uschart = alt.Chart(states).mark_geoshape().encode(
+@timing.timed
+def render_states_viz(statesvreligion, selection):
+    import altair as alt
+
+    states = load_states_feature()
+    uschart = alt.Chart(states).mark_geoshape(stroke="white").encode(
         tooltip=["State:N", 
             alt.Tooltip("Percent Religious:Q", format=".2%"), 
             alt.Tooltip("Protestant:Q", format=".2%"),
@@ -343,7 +641,8 @@ def render_states_viz(statesvreligion):
             alt.Tooltip("Mormon:Q", format=".2%"),
             alt.Tooltip("Agnostic:Q", format=".2%"),
             alt.Tooltip("Atheist:Q", format=".2%")],
-        color=alt.Color("Percent Religious:Q", scale=alt.Scale(scheme="redyellowblue", reverse=True))
+        color=alt.Color("Percent Religious:Q", scale=alt.Scale(scheme="redyellowblue", reverse=True)),
+        opacity=alt.condition(selection, alt.value(1.0), alt.value(0.4))
     ).transform_lookup(
         lookup="id",
         from_=alt.LookupData(
@@ -363,6 +662,8 @@ def render_states_viz(statesvreligion):
                 "Atheist", 
                 "Agnostic"
             ]),
+    ).add_params(
+        selection
     ).properties(
         width=DEFAULT_WIDTH,
         height=DEFAULT_HEIGHT,
@@ -371,41 +672,74 @@ def render_states_viz(statesvreligion):
     ).properties(
         title= "How Religious are the United States?", 
     )
-
-    uschart = uschart.configure_title(
-        fontSize=30,
-        font="IBM Plex Sans")
     return uschart
 
-def stackedtablereligion(selectlist, df):
-    stackedbars = df.drop(columns = ["Percent Religious", "id"]).set_index("State")
-    colnames = list(stackedbars.columns)
-    #set up data
-    data = stackedbars.loc[selectlist, :]
-    data = data.reset_index()
-    data = data.melt(id_vars=['State'], value_vars=colnames,
-            var_name='Religion', value_name='Percent')
+def stackedtablereligion(df, selection=None):
+    import altair as alt
+
+    #set up data for every state; the selection, if any, picks which are shown
+    data = df.drop(columns = ["Percent Religious", "id"])
+    data = data.melt(id_vars=['State'], var_name='Religion', value_name='Percent')
     #Make the stacked bar chart
     stchart = alt.Chart(data).mark_bar().encode(
             x=alt.X('sum(Percent)', scale=alt.Scale(domain=(0, 1)), axis=alt.Axis(format='%', title='Percentage')),
             y='State',
             color=alt.Color('Religion:N',scale=alt.Scale(scheme="redyellowblue")),
             tooltip=['State:N', 'Religion:N', alt.Tooltip('Percent:Q', format='.2%')],
-        ).properties(
+        )
+    if selection is not None:
+        stchart = stchart.transform_filter(selection)
+    stchart = stchart.properties(
             width=DEFAULT_WIDTH,
-            height=DEFAULT_HEIGHT,
         ).properties(
             title="Religions by State"
-        ).interactive()
-    stchart = stchart.configure_title(
+        )
+    return stchart
+
+def create_geography_chart(statesvreligion, with_map=True):
+    """
+    :param statesvreligion The state x religion table, as from prepare_states
+    :param with_map Whether to draw the heat map, which needs the bundled topology
+    :return The heat map above the stacked bars, in a single view; clicking 
+    states on the map filters the bars in the browser, without a rerun.
+    Without the map, the stacked bars alone, for every state
+    """
+    import altair as alt
+
+    if not with_map:
+        return stackedtablereligion(statesvreligion).configure_title(
+            fontSize=30,
+            font="IBM Plex Sans")
+
+    # Click selects a state, shift-click toggles more; with none selected, all are shown
+    selection = alt.selection_point(fields=["State"], on="click", empty=True)
+
+    chart = alt.vconcat(
+        render_states_viz(statesvreligion, selection),
+        stackedtablereligion(statesvreligion, selection)
+    ).resolve_scale(
+        color="independent"
+    ).configure_title(
         fontSize=30,
         font="IBM Plex Sans")
-    return stchart
+    return chart
 
+@timing.timed
+def render_geography_sidebar():
+    """
+    Render the sidebar options for the 'geography' chapter.
 
-def render_geography_chapter(df):
+    :return Whether to show the data as a table
+    """
+    st.sidebar.subheader("The Geography of Belief")
+    return st.sidebar.checkbox("Show the religious data for each state as a table")
+
+@chapter
+def render_geography_chapter(show_table):
     """
     Render the 'geography' chapter.
+
+    :param show_table Whether to show the data as a table
     """
 
     '''
@@ -420,191 +754,127 @@ def render_geography_chapter(df):
     the sidebar under "The Geography of Belief". Prehaps unsurprisingly, states in the South and Midwest tend to be more religious.
     '''
     
-    # Set pandas for first visual
-    statereligion = prepare_states(df, RELIGION_DICT, STATE_DICT)
-
-    # Render the states visualization
-    st.write(render_states_viz(statereligion))
+    # The version of the data shared by every view in this chapter
+    fingerprint = survey.dataset_fingerprint()
+
+    # Render the states visualization, together with the breakdown for each state;
+    # the map is never fetched remotely, so without the bundled topology only the
+    # breakdown is shown
+    topology = states_topology_fingerprint()
+    if topology is None:
+        st.error("The map needs '{}'; build it with `python geography.py`.".format(geography.STATES_TOPOLOGY_PATH))
+    render_chart(
+        "geography", 
+        (fingerprint, topology), 
+        (),
+        lambda: create_geography_chart(load_state_religion(fingerprint), topology is not None))
 
     '''
-    The sidebar has a couple of interesting options available for this visualization. You can:
+    Below the map, you can explore the percentages of each state that subscribe to different religions and compare states against each other. Click on a state in the map to show only that state, and hold shift while clicking to add more states to the comparison. Click on an empty part of the map to show every state again.
 
-    - Render the raw data from which this graphic was generated
-    - Explore the percentages of each state that subscribe to different religions and compare states against each other.
+    The sidebar also has an option to render the raw data from which this graphic was generated.
     '''
 
-    #-------------------------------------------------------------------
-    # Sidebar
-    #-------------------------------------------------------------------
-    st.sidebar.subheader("The Geography of Belief")
-
     # Selectively render the data for the states visualization
-    if st.sidebar.checkbox("Show the religious data for each state as a table"):
+    if show_table:
         '''
         ### Breakdown of States and their Religious Make-up
 
         By clicking on the column titles, you can discover which religions are most prominent in different states and find states and regions that have larger populations of certain sects. For example, if you click on 'Mormon' you will find that Utah and the surrounding states have the highest percent of Mormons with respect to the other religions. Here it is also easier to see visually that the majority of individuals in most states claim to be Protestant. All values are percentages.
         '''
 
+        statereligion = load_state_religion(fingerprint)
         statedf = statereligion.drop(
             columns = ["Percent Religious", "id"]).set_index("State").apply(lambda x: x*100)
         st.write(statedf)
 
-    if st.sidebar.checkbox("Compare States"):
-        st.sidebar.write("Compare the religious breakdowns for each state. You can select multiple options.")
-        stateselect = st.sidebar.multiselect("State", statereligion, key='State')
-        if stateselect != []:
-            '''
-            ### Compare States
-
-            Here you can visually compare the different religions in each state as well as compare states against each other. Remember you can select multiple states at the same time!
-            '''
-
-            stateselectchart = stackedtablereligion(stateselect, statereligion)
-            st.write(stateselectchart)
-
 # -----------------------------------------------------------------------------
 # Chapter: Connection
 # -----------------------------------------------------------------------------
 
+@timing.timed
 def create_belief_df(df):
-    columnstodrop = [
-        21.0, 22.0, 23.0, 24.0, 25.0, 30.0, 31.0, 32.0, 33.0, 34.0,
-        35.0, 36.0, 37.0, 38.0, 39.0, 43.0, 44.0, 45.0, 46.0, 50.0,
-        51.0, 52.0, 53.0, 54.0, 55.0, 56.0, 57.0, 59.0, 61.0, 62.0,
-        63.0, 64.0, 65.0, 70.0, 71.0, 72.0, 73.0, 74.0, 75.0, 76.0,
-        77.0, 78.0, 79.0, 81.0, 82.0, 83.0, 84.0, 85.0, 86.0, 88.0,
-        90.0, 94.0, 96.0, 994.0, 999.0]
-    belief = {
-        "qe1":   "Religion",
-        "qb1a":  "Immigration",
-        "qb1b":  "Women in Workforce",
-        "qb1c":  "Children Out of Wedlock",
-        "qb2a":  "Homosexuality",
-        "qb2b":  "Government Aid",
-        "qb2c":  "Environmental Regulations",
-        "qb2d":  "Morality",
-        "qb20":  "Government Size",
-        "qb21":  "Abortion",
-        "qb22":  "Gay Marriage",
-        "qb30":  "Evolution",
-        "qb31":  "Guidance in Life",
-        "party": "Political Party"}
-    
-    imm = {
-        1.0: "Positive Change",
-        2.0:"Negative Change",
-        3.0:"No Change",
-        4.0:"Mixed Change",
-        9.0:"Unsure"}
-
-    hom = {
-        1.0: "Accepted by Society",
-        2.0: "Rejected by Society",
-        3.0: "Both Equally",
-        9.0: "Unsure"}
-
-    govaid = {
-        1.0: "More Harm than Good",
-        2.0: "More Good than Harm",
-        3.0: "Both Equally",
-        9.0:"Unsure"}
-
-    envr = {
-        1.0: "Hurt the Economy",
-        2.0: "Worth the cost",
-        3.0: "Both Equally",
-        9.0:"Unsure"}
-
-    more = {
-        1.0: "Situationally Dependent",
-        2.0: "Absolute Standards for Right and Wrong",
-        3.0: "Both Equally",
-        9.0: "Unsure"}
-    govsize = {
-        1.0: "Small",
-        2.0: "Large",
-        3.0: "Depends",
-        9.0: "Unsure"}
-
-    ab = {
-        1.0: "Legal",
-        2.0: "Legal in Most Cases",
-        3.0: "Illegal in Most Cases",
-        4.0: "Illegal", 
-        9.0:"Unsure"}
-    gm = {
-        1.0: "Strongly favor",
-        2.0: "Favor",
-        3.0: "Oppose",
-        4.0: "Strongly Oppose",
-        9.0: "Unsure"}
-
-    evo = {
-        1.0: "Agree",
-        2.0: "Disagree",
-        9.0: "Unsure"}
-
-    gil = {
-        1.0: "Religious Teachings",
-        2.0: "Philosphy and Reason",
-        3.0: "Practical Experience",
-        4.0: "Scientific Information",
-        9.0: "Unsure"}
-
-    pp = {
-        1.0: "Republican",
-        2.0: "Democrat",
-        3.0: "Independent", 
-        4.0: "No Preference",
-        5.0: "Other", 
-        9.0: "Unsure"}
-
-    #retrieve required columns, rename them, and drop unneeded rows
-    beliefdf=df[[
-        "qe1",
-        "qb1a",
-        "qb1b",
-        "qb1c",
-        "qb2a",
-        "qb2b",
-        "qb2c",
-        "qb2d",
-        "qb20",
-        "qb21",
-        "qb22",
-        "qb30",
-        "qb31",
-        "party"]].copy()
-    
-    beliefdf = beliefdf.rename(columns=belief)
-    for val in columnstodrop:
-        beliefdf = beliefdf[beliefdf.Religion != val]
+    #retrieve required columns, rename them, and drop unneeded rows in one pass
+    beliefdf = df[CONNECTION_COLUMNS].rename(columns=BELIEF_DICT)
+    beliefdf = beliefdf[~beliefdf.Religion.isin(DROPPED_RELIGION_CODES)]
     
-    # Update values for easy read
-    beliefdf = beliefdf.replace({
-        "Immigration" : imm,
-        "Women in Workforce" : imm, 
-        "Children Out of Wedlock" : imm, 
-        "Religion": RELIGION_DICT, 
-        "Homosexuality": hom, 
-        "Government Aid": govaid,
-        "Environmental Regulations": envr,
-        "Morality": more,
-        "Government Size": govsize, 
-        "Abortion": ab,
-        "Gay Marriage": gm,
-        "Evolution": evo,
-        "Guidance in Life": gil,
-        "Political Party": pp})
+    # Responses stay as compact integer codes; labels are
+    # attached only when the data is charted or displayed
     return beliefdf
 
-def create_belief_compare_chart(bdf, issue, religionlist):
-    # Update bdf for specific issue and set of religions
-    belief = pd.get_dummies(bdf[issue]).copy()
-    belief['Religion'] = bdf['Religion']
-    belief = belief.groupby('Religion').sum()
-    belief = belief.loc[religionlist, :]
+# Labels coded responses through an array lookup from code to category,
+# giving a categorical that keeps compact codes rather than strings
+def decode_codes(codes, codebook):
+    keys = np.array(list(codebook.keys()), dtype=np.int64)
+    answered = codes.notna().to_numpy()
+    values = codes.to_numpy(dtype=np.int64, na_value=0)
+
+    # Codes missing from the codebook, and missing answers, have no label
+    lookup = np.full(max(keys.max(), values.max(initial=0)) + 1, -1, dtype=np.int64)
+    lookup[keys] = np.arange(len(keys))
+    categories = np.where(answered, lookup[values], -1)
+    return pd.Categorical.from_codes(categories, categories=list(codebook.values()))
+
+# Attach readable labels to the coded responses for display
+def decode_belief_df(bdf):
+    decoded = {}
+    for column in bdf.columns:
+        decoded[column] = decode_codes(bdf[column], BELIEF_RESPONSE_DICTS[column])
+    return pd.DataFrame(decoded, index=bdf.index)
+
+# Counts the respondents giving each response to each issue, by religion,
+# into a dense array indexed by [issue (from BELIEF_ISSUES), religion code, response code]
+def create_belief_cube(bdf):
+    religions = bdf["Religion"]
+    religionsize = int(religions.max()) + 1
+    responsesize = int(bdf[BELIEF_ISSUES].max().max()) + 1
+
+    cube = np.zeros((len(BELIEF_ISSUES), religionsize, responsesize), dtype=np.int64)
+    for i, issue in enumerate(BELIEF_ISSUES):
+        answered = (religions.notna() & bdf[issue].notna()).to_numpy()
+        cells = religions[answered].to_numpy(np.int64)*responsesize + bdf[issue][answered].to_numpy(np.int64)
+        cube[i] = np.bincount(cells, minlength=religionsize*responsesize).reshape(religionsize, responsesize)
+    return cube
+
+# Fills the belief cube from the counts of each response to each issue
+# by religion, as streamed by survey.stream_counts over COUNT_PAIRS
+def create_belief_cube_from_counts(counts):
+    tables = [
+        survey.drop_unanswered(counts[issue]).drop(index=DROPPED_RELIGION_CODES, errors="ignore")
+        for issue in BELIEF_ISSUES]
+    religionsize = int(max(table.index.max() for table in tables)) + 1
+    responsesize = int(max(table.columns.max() for table in tables)) + 1
+
+    cube = np.zeros((len(BELIEF_ISSUES), religionsize, responsesize), dtype=np.int64)
+    for i, table in enumerate(tables):
+        religions = table.index.to_numpy(np.int64)
+        responses = table.columns.to_numpy(np.int64)
+        cube[i][np.ix_(religions, responses)] = table.to_numpy(np.int64)
+    return cube
+
+# Builds the comparison chart by slicing the belief cube
+def create_belief_compare_chart_from_cube(cube, issue, religionlist):
+    counts = cube[BELIEF_ISSUES.index(issue)]
+
+    # Only the responses that someone gave to this issue
+    responses = np.flatnonzero(counts.sum(axis=0))
+    religions = [RELIGION_CODES[r] for r in religionlist]
+    counts = pd.DataFrame(counts[religions][:, responses], index=religions, columns=responses)
+    return create_belief_compare_chart_from_counts(counts, issue, religionlist)
+
+# Builds the comparison chart from the counts of each response to the issue
+# by religion, which may come from survey.stream_counts over ("qe1", question)
+def create_belief_compare_chart_from_counts(counts, issue, religionlist):
+    import altair as alt
+
+    # Update counts for specific set of religions
+    belief = survey.drop_unanswered(counts)
+    belief = belief.loc[[RELIGION_CODES[r] for r in religionlist], :]
+
+    # Label the religions and responses now that the data is aggregated
+    belief = belief.rename(index=RELIGION_DICT, columns=BELIEF_RESPONSE_DICTS[issue])
+    belief.index.name = "Religion"
+    belief.columns.name = None
     opinions = list(belief.columns)
     belief = belief.div(belief.sum(axis=1), axis=0) 
     belief = belief.reset_index()
@@ -626,9 +896,22 @@ def create_belief_compare_chart(bdf, issue, religionlist):
         font="IBM Plex Sans")
     return result
 
-def render_connection_chapter(df):
+@timing.timed
+def render_connection_sidebar():
+    """
+    Render the sidebar options for the 'connection' chapter.
+
+    :return Whether to show the data as a table
+    """
+    st.sidebar.subheader("How Our Beliefs Shape Us")
+    return st.sidebar.checkbox("Show the data for beliefs with respect to religion as a table.")
+
+@chapter
+def render_connection_chapter(show_table):
     """
     Render the 'connection' chapter.
+
+    :param show_table Whether to show the data as a table
     """
 
     '''
@@ -641,7 +924,11 @@ def render_connection_chapter(df):
     We acknowledge that other factors outside religion can impact how an individual develops their belief system. However, it is interesting to see how a difference in religious view can result in widely different opinions on various moral and soial issues.
     '''  
     
-    bdf = create_belief_df(df)
+    fingerprint = survey.dataset_fingerprint()
+
+    # Built once per version even before any religion is selected, so that a
+    # prewarm run builds it and the first selection only slices it
+    cube = load_belief_cube(fingerprint)
 
     '''
     Select a belief or issue from the list below. Then, select one or more religions you would like to look at. You will be able to look at the breakdown of each religion by stance and compare them to other religions. You will find some interesting distributions especially if you compare various religions with atheism. For example, a much lower proportion of respondents who claim to be Atheist are against abortion when compared to Roman Catholic, Muslim, and Jehovah's Witness respondents.
@@ -680,8 +967,11 @@ def render_connection_chapter(df):
             "Christian",
             "Unaffiliated"])
         if religionselect != []:
-            beliefchart = create_belief_compare_chart(bdf, beliefselect, religionselect)
-            st.write(beliefchart)
+            render_chart(
+                "belief", 
+                fingerprint, 
+                (beliefselect, tuple(religionselect)),
+                lambda: create_belief_compare_chart_from_cube(cube, beliefselect, religionselect))
     
     '''
     The sidebar has a couple of interesting options available for this visualization. You can:
@@ -689,25 +979,75 @@ def render_connection_chapter(df):
     - Render the raw data from which this graphic was generated. Note the data is presented by individual responder.
     '''
 
-    # Sidebar
-    st.sidebar.subheader("How Our Beliefs Shape Us")
-
-    if st.sidebar.checkbox("Show the data for beliefs with respect to religion as a table."):
+    if show_table:
         '''
         ### Breakdown of Beliefs by Religion
 
         Here you can look at individual respondents who answered a series of questions about the issues shown above. Individuals are characterized by their claimed religious beliefs.
         '''
 
-        st.write(bdf.set_index("Religion"))
+        if survey.has_respondents():
+            bdf = create_belief_df(load_primary_data(CONNECTION_COLUMNS))
+            st.write(decode_belief_df(bdf).set_index("Religion"))
+        else:
+            st.info("Only the counts of this survey are available here, not its individual respondents.")
 
 # -----------------------------------------------------------------------------
 # Chapter: Evolution
 # -----------------------------------------------------------------------------
 
-def render_evolution_chapter():
+def create_evolution_chart(df):
+    import altair as alt
+
+    # Reformat the data for plotting, one row per age and response
+    plot = df.melt(id_vars=["Age"], var_name="Response", value_name="Percent")
+
+    # Bind the age to a slider in the chart itself, so that moving 
+    # the slider filters the data in the browser without a rerun
+    age = alt.param(
+        name="age",
+        value=MIN_AGE,
+        bind=alt.binding_range(min=MIN_AGE, max=MAX_AGE, step=1, name="Age "))
+
+    viz = alt.Chart(plot).mark_bar(color=COLOR_SCHEME_BLUE).encode(
+        x=alt.X("Response:N"),
+        y=alt.Y("Percent:Q", scale=alt.Scale(domain=[0.0, 1.0])),
+        tooltip=[alt.Tooltip('Percent:Q', format='.2%')]
+    ).add_params(
+        age
+    ).transform_filter(
+        alt.datum.Age == age
+    ).properties(
+        width=DEFAULT_WIDTH,
+        height=DEFAULT_HEIGHT
+    ).interactive()
+
+    viz = viz.configure_title(
+        fontSize=30,
+        font="IBM Plex Sans")
+    return viz
+
+@timing.timed
+def render_evolution_sidebar():
+    """
+    Render the sidebar options for the 'evolution' chapter.
+
+    :return Whether to show the full question text, the data and the methodology
+    """
+    st.sidebar.subheader("How Our Beliefs Evolve")
+    full_text = st.sidebar.checkbox("Show Full Question Text")
+    show_data = st.sidebar.checkbox("Show the Data")
+    methodology = st.sidebar.checkbox("Methodology", key="EvolutionMethodology")
+    return full_text, show_data, methodology
+
+@chapter
+def render_evolution_chapter(full_text, show_data, methodology):
     """
     Render the 'evolution' chapter.
+
+    :param full_text Whether to show the full question text
+    :param show_data Whether to show the data
+    :param methodology Whether to show the methodology
     """
 
     '''
@@ -725,12 +1065,6 @@ def render_evolution_chapter():
     To interact with the graphic, select a question of interest from the dropdown list below. Once a question is selected, you can see the distribution of responses to that question for the currently-selected age. Then, you can utilize the slider to change the selected age and observe how the distribution of responses changes.
     '''
 
-    # Sidebar
-    st.sidebar.subheader("How Our Beliefs Evolve")
-    full_text = st.sidebar.checkbox("Show Full Question Text")
-    show_data = st.sidebar.checkbox("Show the Data")
-    methodology = st.sidebar.checkbox("Methodology", key="EvolutionMethodology")
-
     # Load a map from question -> dataframe
     frames = load_evolution_data()
 
@@ -739,30 +1073,6 @@ def render_evolution_chapter():
     
     # Select the appropriate data to render based on the selection
     df = frames[option]
-    df = df.drop(columns=["Unnamed: 0"])
-
-    # Select the appropriate age based on the slider value
-    age = st.slider(label="Age", min_value=MIN_AGE, max_value=MAX_AGE)
-    tmp = df.loc[df["Age"] == age]
-    
-    # Reformat the data for plotting
-    plot = pd.DataFrame()
-    for c in filter(lambda x: x != "Age", tmp.columns):
-        plot = plot.append(pd.DataFrame(np.matrix([c, tmp.iloc[0][c]])))    
-    plot.columns = ["Response", "Percent"]
-
-    viz = alt.Chart(plot).mark_bar(color=COLOR_SCHEME_BLUE).encode(
-        x=alt.X("Response:N"),
-        y=alt.Y("Percent:Q", scale=alt.Scale(domain=[0.0, 1.0])),
-        tooltip=[alt.Tooltip('Percent:Q', format='.2%')]
-    ).properties(
-        width=DEFAULT_WIDTH,
-        height=DEFAULT_HEIGHT
-    ).interactive()
-
-    viz = viz.configure_title(
-        fontSize=30,
-        font="IBM Plex Sans")
 
     if full_text:
         '''
@@ -772,7 +1082,12 @@ def render_evolution_chapter():
         '''
         st.write("'" + EVOLUTION_FULL_QUESTIONS[option] + "'")
 
-    st.write(viz)
+    # The chart carries the data for every age, and its own age slider
+    render_chart(
+        "evolution", 
+        survey.file_fingerprint(EVOLUTION_QUESTIONS[option]), 
+        (option,),
+        lambda: create_evolution_chart(df))
 
     '''
     The sidebar has a couple of interesting options available for this visualization. You can:
@@ -801,33 +1116,30 @@ def render_evolution_chapter():
 # Chapter: Future
 # -----------------------------------------------------------------------------
 
-def count_for_label_at_year(df, label, year):
-    tmp = df[df["Religion"].str.contains(label)]
-    tmp = tmp[tmp["Year"] == year]
-    return tmp.iloc[0]["Count"]
-
-def get_diff_for_label(df, label, metric):
-  return int(df[df["Religion"].str.contains(label)][metric])
-
 def preprocess_for_diff_viz(df):
-    new = pd.DataFrame()
-    for label in FUTURE_COLUMN_HEADERS:
-        start = count_for_label_at_year(df, label, 0)
-        stop = count_for_label_at_year(df, label, 99)
-        diff = stop - start
-        prop = int(((stop - start) / start)*100)
-        new = new.append(pd.DataFrame(np.matrix([label, diff, prop])))
-    new.columns = ["Religion", "Delta", "Prop"]
-    return new
+    # Index the counts by (Year, Religion) once, with one column per religion
+    counts = df.set_index(["Year", "Religion"])["Count"].unstack()
+
+    # Compare the first and last year of the projection for every religion at once
+    start = counts.loc[counts.index.min()]
+    stop = counts.loc[counts.index.max()]
+    diff = stop - start
+    return pd.DataFrame({
+        "Religion": counts.columns,
+        "Delta": diff.to_numpy(),
+        "Prop": ((diff / start)*100).astype(np.int64).to_numpy()})
+
+def order_for_diff_viz(pre, metric):
+    # The religions from greatest loss to greatest gain; ties keep their order
+    order = np.argsort(pre[metric].to_numpy(), kind="stable")
+    return list(pre["Religion"].to_numpy()[order])
+
+# Build the stacked area chart that illustrates growth
+def create_future_area_chart(df):
+    import altair as alt
 
-# Render the stacked area chart that illustrates growth
-def render_future_area_viz(df):
     # Make a selection for interactive legend
-    selection = alt.selection_multi(fields=["Religion"], bind="legend")
-
-    '''
-    In the visualization below, we plot the total number of adherents to each religious tradition, normalized to the total population projected for the relevant timestep. You can select individual options in the legend to isolate a single religion.
-    '''
+    selection = alt.selection_point(fields=["Religion"], bind="legend")
 
     # Make the chart
     future = alt.Chart(df).mark_area().encode(
@@ -839,7 +1151,7 @@ def render_future_area_viz(df):
     ).properties(
         width=DEFAULT_WIDTH,
         height=DEFAULT_HEIGHT
-    ).add_selection(
+    ).add_params(
         selection
     ).properties(
         title="The Changing in Religious Landscape"
@@ -847,24 +1159,29 @@ def render_future_area_viz(df):
     future = future.configure_title(
         fontSize=30,
         font="IBM Plex Sans")
+    return future
 
-    st.write(future)
+# Render the stacked area chart that illustrates growth
+@timing.timed
+def render_future_area_viz(df, version):
+    '''
+    In the visualization below, we plot the total number of adherents to each religious tradition, normalized to the total population projected for the relevant timestep. You can select individual options in the legend to isolate a single religion.
+    '''
+
+    render_chart("future_area", version, (), lambda: create_future_area_chart(df))
+
+# Build the bar chart that illustrates gain / loss for each religion
+def create_future_diff_chart(df, absolute_diff):
+    import altair as alt
 
-# Render the bar chart that illustrates gain / loss for each religion
-def render_future_diff_viz(df):
     # Do some preprocessing
     pre = preprocess_for_diff_viz(df)
 
-    absolute_diff = st.sidebar.checkbox("Show Absolute Differences")
-    
-    order = [label for label in pre["Religion"]]
-
     column_label = "Delta" if absolute_diff else "Prop"
+    order = order_for_diff_viz(pre, column_label)
     if absolute_diff:
-        order = sorted(order, key=lambda x: get_diff_for_label(pre, x, "Delta"))
         charttitle = "Religious Adherence Gains and Loses (Absolute)"
     else:
-        order = sorted(order, key=lambda x: get_diff_for_label(pre, x, "Prop"))
         charttitle = "Religious Adherence Gains and Loses (Percentage)"
 
     # Render the chart
@@ -886,7 +1203,11 @@ def render_future_diff_viz(df):
     chart = chart.configure_title(
         fontSize=30,
         font="IBM Plex Sans")
+    return chart
 
+# Render the bar chart that illustrates gain / loss for each religion
+@timing.timed
+def render_future_diff_viz(df, version, absolute_diff):
     if absolute_diff:
         '''
         With 'Absolute Differences' selected, the chart below shows the total gain loss for number of religious adherents in each faith.
@@ -896,11 +1217,64 @@ def render_future_diff_viz(df):
         In this default view, the chart below shows the gain and loss for each belief system, as a percentage relative to the current number of adherenets.
         '''
 
-    st.write(chart)
+    render_chart(
+        "future_diff", 
+        version, 
+        (absolute_diff,), 
+        lambda: create_future_diff_chart(df, absolute_diff))
+
+# Build the small multiples that illustrate the uncertainty in the projection
+def create_future_bands_chart(df):
+    import altair as alt
+
+    base = alt.Chart(df).encode(
+        x=alt.X("Year:Q"))
+
+    band = base.mark_area(opacity=0.3, color=COLOR_SCHEME_BLUE).encode(
+        y=alt.Y("Low:Q", title="Adherents"),
+        y2="High:Q",
+        tooltip=["Year:Q", "Low:Q", "Median:Q", "High:Q"])
+
+    line = base.mark_line(color=COLOR_SCHEME_BLUE).encode(
+        y="Median:Q")
+
+    chart = alt.layer(band, line).properties(
+        width=DEFAULT_WIDTH / 4,
+        height=DEFAULT_HEIGHT / 4
+    ).facet(
+        facet="Religion:N",
+        columns=4
+    ).resolve_scale(
+        y="independent"
+    ).properties(
+        title="How Certain is the Projection?"
+    )
+    chart = chart.configure_title(
+        fontSize=30,
+        font="IBM Plex Sans")
+    return chart
 
-def render_future_chapter():
+@timing.timed
+def render_future_sidebar():
+    """
+    Render the sidebar options for the 'future' chapter.
+
+    :return Whether to show absolute differences, the data and the methodology
+    """
+    st.sidebar.subheader("The Shape of our Future Beliefs")
+    absolute_diff = st.sidebar.checkbox("Show Absolute Differences")
+    show_data = st.sidebar.checkbox("Show Data")
+    methodology = st.sidebar.checkbox("Methodology", key="FutureMethodology")
+    return absolute_diff, show_data, methodology
+
+@chapter
+def render_future_chapter(absolute_diff, show_data, methodology):
     """
     Render the 'future' chapter.
+
+    :param absolute_diff Whether to show absolute rather than relative differences
+    :param show_data Whether to show the data
+    :param methodology Whether to show the methodology
     """
 
     '''
@@ -912,21 +1286,28 @@ def render_future_chapter():
     As was mentioned in the introduction, religious belief is a complex and multifaceted topic, and accordingly it is difficult to predict with much accuracy. Our analysis here builds on [prior work](https://fivethirtyeight.com/features/evangelical-protestants-are-the-biggest-winners-when-people-change-faiths/) by journalist [Leah Libresco](https://fivethirtyeight.com/contributors/leah-libresco/). In brief, Libresco combines the results of the 2007 iteration of the Pew Religions Survey with the Results from 2014 to compute a transition matrix that encodes the rate at which adherents join and leave belief systems. We then use this transition matrix to make projections on the number of people with self-professed membership in each faith at points in the future. You can read a more comprehensive description of the methodology by selecting the 'Methodology' box in the sidebar. 
     '''
 
-    df = load_future_data()
+    version = survey.file_fingerprint(FUTURE_DATA_PATH)
+    df = load_future_data(version)
     df = df.drop(columns=["Unnamed: 0"])
 
-    st.sidebar.subheader("The Shape of our Future Beliefs")
-
-    render_future_area_viz(df)
+    render_future_area_viz(df, version)
 
     '''
     While the visualization above concisely encodes the data on this particular question, it is somewhat difficult to determine the degree of the gain and loss for individual religious beliefs. The graphic below depicts both the relative and absolute gain and loss for each belief system, ordered from greatest loss to greatest gain.
     '''
 
-    render_future_diff_viz(df)
+    render_future_diff_viz(df, version, absolute_diff)
 
-    show_data = st.sidebar.checkbox("Show Data")
-    methodology = st.sidebar.checkbox("Methodology", key="FutureMethodology")
+    '''
+    Of course, the rates at which people join and leave belief systems, and the rates at which they have children, are themselves uncertain. To get a sense for how much the projection depends on them, we repeat it for thousands of scenarios in which each of these rates is perturbed at random. The shaded band for each religion covers the middle 90% of the scenarios, and the line follows the median scenario.
+    '''
+
+    bands_version = survey.file_fingerprint(FUTURE_BANDS_DATA_PATH)
+    render_chart(
+        "future_bands", 
+        bands_version, 
+        (),
+        lambda: create_future_bands_chart(load_future_bands_data(bands_version)))
 
     if show_data:
         '''
@@ -942,6 +1323,8 @@ def render_future_chapter():
 
         With this transition matrix in hand, we then compute the proportion of adherents to each religious tradition in successive timesteps by applying the transition matrix to the initial proportions. This process is applied iteratively until the desired time horizon is reached. Finally, we scale these proportions by the projected United States population in order to compute the total number of adherents to each religious system at each timestep.
 
+        To estimate the uncertainty in this projection, we sample ten thousand scenarios, each of which scales every transition rate and every fertility rate by a small random factor (rescaling the transition rates of each religion so that they keep the same total as in the transition matrix above), and project all of them in the same way. Without any random factors, every scenario is exactly the projection above. The bands show the 5th to 95th percentile of the resulting number of adherents in each year.
+
         We make a couple of simplifying assumptions in this analysis. First, iteratively applying the transition matrix out across long time horizons introduces the implicit assumption that the current rates of religious conversion remain constant. Of course, this need not be the case. Furthermore, our population analysis is based on a very simple model of projected United States population that assumes a growth rate commensurate with that observed in the last eighty years. It is entirely possible that the population growth rate changes (likely slowing) which would change the numbers observed in the absolute breakdown.
         '''
 
@@ -950,24 +1333,29 @@ def render_future_chapter():
 # -----------------------------------------------------------------------------
 
 def main():
-    # Load the datasets
-    df_primary = load_primary_data()
-    
-    render_introduction_content()
+    with timing.span("run"):
+        render_introduction_content()
+
+        # Each chapter is a fragment, so that interacting with the widgets in 
+        # a chapter reruns only that chapter; fragments cannot write to the 
+        # sidebar, so the sidebar options of each chapter are rendered here
+
+        # Chapter 1: Geography
+        render_geography_chapter(render_geography_sidebar())
 
-    # Chapter 1: Geography
-    render_geography_chapter(df_primary)
+        # Chapter 2: Connection
+        render_connection_chapter(render_connection_sidebar())
 
-    # Chapter 2: Connection
-    render_connection_chapter(df_primary)
+        # Chapter 3: Evolution
+        render_evolution_chapter(*render_evolution_sidebar())
 
-    # Chapter 3: Evolution
-    render_evolution_chapter()
+        # Chapter 4: Future
+        render_future_chapter(*render_future_sidebar())
 
-    # Chapter 4: Future
-    render_future_chapter()
+        render_conclusion_content()
 
-    render_conclusion_content()
+    render_diagnostics()
+    export_metrics()
 
 # -----------------------------------------------------------------------------
 # Application Entry Point
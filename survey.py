@@ -0,0 +1,365 @@
+# survey.py
+#
+# Loading for the primary survey dataset.
+#
+# Parsing the original SPSS file with pyreadstat is slow, so we
+# convert it once to an Arrow IPC (Feather) file that lives next
+# to it and read from that file afterwards. The converted file
+# records a fingerprint of the SPSS file from which it was built,
+# and it is rebuilt whenever the SPSS file changes.
+#
+# For survey files too large to hold in memory, stream_counts
+# reads the SPSS file in chunks of rows and accumulates only the
+# counts that the chapters aggregate the respondents into. Those
+# counts are saved next to the survey, with its fingerprint, so that
+# the application can use them instead of loading the respondents.
+
+import os
+import tempfile
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.feather as feather
+
+# -----------------------------------------------------------------------------
+# General Constants
+# -----------------------------------------------------------------------------
+
+# The relative path to the data directory
+DATA_PATH = "data/"
+
+# The location of the original SPSS dataset
+PRIMARY_DATA_PATH = DATA_PATH + "data.sav"
+
+# The location of the converted columnar dataset
+PRIMARY_CACHE_PATH = DATA_PATH + "data.arrow"
+
+# The location of the counts streamed from the original SPSS dataset
+COUNTS_PATH = DATA_PATH + "counts.npz"
+
+# The schema metadata key under which we record the source fingerprint
+FINGERPRINT_KEY = b"source_fingerprint"
+
+# The version of the conversion; bump this whenever the layout
+# of the converted dataset changes so that stale copies are rebuilt
+CACHE_VERSION = 2
+
+# The number of rows read at a time when streaming the SPSS file
+CHUNK_SIZE = 100000
+
+# Map compact code type -> the nullable type used when values are missing
+NULLABLE_CODE_TYPES = {
+    "uint8":  "UInt8",
+    "uint16": "UInt16"
+}
+
+# -----------------------------------------------------------------------------
+# Conversion
+# -----------------------------------------------------------------------------
+
+def file_fingerprint(path):
+    """
+    :param path The path to a file
+    :return A string that changes whenever the file changes
+    """
+    stat = os.stat(path)
+    return "{}:{}:{}".format(path, stat.st_size, stat.st_mtime_ns)
+
+def source_fingerprint(path=PRIMARY_DATA_PATH):
+    """
+    :param path The path to the original SPSS dataset
+    :return A string that changes whenever the file or the
+    layout of the converted dataset changes
+    """
+    stat = os.stat(path)
+    return "v{}:{}:{}".format(CACHE_VERSION, stat.st_size, stat.st_mtime_ns)
+
+def dataset_fingerprint(source=PRIMARY_DATA_PATH, target=PRIMARY_CACHE_PATH, counts=COUNTS_PATH):
+    """
+    :param source The path to the original SPSS dataset
+    :param target The path to the converted dataset
+    :param counts The path to the counts streamed from the original dataset
+    :return A string that identifies the version of the primary dataset,
+    for keying caches of values derived from it
+    """
+    if os.path.exists(source):
+        return source_fingerprint(source)
+    if os.path.exists(target):
+        return file_fingerprint(target)
+    return counts_fingerprint(counts)
+
+def cached_fingerprint(path=PRIMARY_CACHE_PATH):
+    """
+    :param path The path to the converted dataset
+    :return The fingerprint recorded in the converted dataset,
+    or None if it does not exist
+    """
+    if not os.path.exists(path):
+        return None
+    with pa.memory_map(path) as source:
+        metadata = pa.ipc.open_file(source).schema.metadata or {}
+    fingerprint = metadata.get(FINGERPRINT_KEY)
+    return fingerprint.decode() if fingerprint is not None else None
+
+def has_respondents(source=PRIMARY_DATA_PATH, target=PRIMARY_CACHE_PATH):
+    """
+    :param source The path to the original SPSS dataset
+    :param target The path to the converted dataset
+    :return True if the individual respondents can be read
+    """
+    return os.path.exists(source) or os.path.exists(target)
+
+def is_cache_fresh(source=PRIMARY_DATA_PATH, target=PRIMARY_CACHE_PATH):
+    """
+    :param source The path to the original SPSS dataset
+    :param target The path to the converted dataset
+    :return True if the converted dataset may be used as-is
+    """
+    # Deployments may ship only the converted file
+    if not os.path.exists(source):
+        return os.path.exists(target)
+    return cached_fingerprint(target) == source_fingerprint(source)
+
+def compact_codes(df):
+    """
+    Store every column of integer codes in the smallest unsigned
+    integer type that holds it; pyreadstat reads them as float64.
+    Columns with missing values use the nullable pandas type.
+
+    :param df The dataframe as read from the SPSS file
+    :return The dataframe with compact column types
+    """
+    for column in df.columns:
+        values = df[column]
+        if values.dtype.kind != "f":
+            continue
+
+        present = values.dropna()
+        if not ((present % 1 == 0) & (present >= 0)).all():
+            continue
+
+        largest = present.max() if not present.empty else 0
+        if largest <= np.iinfo(np.uint8).max:
+            dtype = "uint8"
+        elif largest <= np.iinfo(np.uint16).max:
+            dtype = "uint16"
+        else:
+            continue
+
+        if len(present) < len(values):
+            dtype = NULLABLE_CODE_TYPES[dtype]
+        df[column] = values.astype(dtype)
+    return df
+
+def replace_file(target, write):
+    """
+    :param target The path of the file to replace
+    :param write A function of a path that writes the new file there
+    """
+    # Write to a temporary file of our own in the same directory first, so
+    # that readers never observe a partially-written file and concurrent
+    # writers (e.g. a prewarm and a session) never write to the same one
+    fd, tmp = tempfile.mkstemp(
+        prefix=os.path.basename(target) + ".", suffix=".tmp", dir=os.path.dirname(target) or ".")
+    os.close(fd)
+    try:
+        write(tmp)
+        os.replace(tmp, target)
+    except BaseException:
+        os.remove(tmp)
+        raise
+
+def convert_primary_data(source=PRIMARY_DATA_PATH, target=PRIMARY_CACHE_PATH):
+    """
+    :param source The path to the original SPSS dataset
+    :param target The path to which the converted dataset is written
+    """
+    fingerprint = source_fingerprint(source)
+    df = pd.read_spss(source, convert_categoricals=False)
+
+    # Newer versions of pandas attach the SPSS metadata here,
+    # which is not serializable alongside the table
+    df.attrs = {}
+    df = compact_codes(df)
+
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    metadata = dict(table.schema.metadata or {})
+    metadata[FINGERPRINT_KEY] = fingerprint.encode()
+    table = table.replace_schema_metadata(metadata)
+
+    replace_file(target, lambda path: feather.write_feather(table, path, compression="uncompressed"))
+
+# -----------------------------------------------------------------------------
+# Loading
+# -----------------------------------------------------------------------------
+
+def read_primary_data(columns=None, source=PRIMARY_DATA_PATH, target=PRIMARY_CACHE_PATH):
+    """
+    :param columns The columns to read, or None to read all of them;
+    only the requested columns are read from disk
+    :param source The path to the original SPSS dataset
+    :param target The path to the converted dataset
+    :return The primary dataset, converting it first if required;
+    its columns are memory-mapped and must not be modified in place
+    """
+    if not is_cache_fresh(source, target):
+        convert_primary_data(source, target)
+    columns = list(columns) if columns is not None else None
+    table = feather.read_table(target, columns=columns, memory_map=True)
+
+    # One block per column lets pandas use the mapped buffers of the
+    # columns without missing values directly (read-only) instead of
+    # copying them into a consolidated block
+    return table.to_pandas(split_blocks=True)
+
+def read_only(df):
+    """
+    :param df A dataframe of numeric columns
+    :return A copy of the dataframe whose columns cannot be modified in
+    place, so that it can be shared safely between sessions
+    """
+    columns = {}
+    for column in df.columns:
+        values = df[column].to_numpy(copy=True)
+        values.flags.writeable = False
+        columns[column] = values
+    return pd.DataFrame(columns, index=df.index, copy=False)
+
+# -----------------------------------------------------------------------------
+# Counting
+# -----------------------------------------------------------------------------
+
+def count_pairs(df, row, column):
+    """
+    :param df The input dataframe
+    :param row The column whose codes label the rows of the result
+    :param column The column whose codes label the columns of the result
+    :return The number of respondents with each pair of codes; missing
+    codes are counted under NaN so that the totals include everyone
+    """
+    counts = df.groupby([row, column], dropna=False).size()
+    return counts.unstack(fill_value=0)
+
+def drop_unanswered(counts):
+    """
+    :param counts The counts, as from count_pairs
+    :return The counts of respondents who answered both questions
+    """
+    return counts.loc[counts.index.notna(), counts.columns.notna()]
+
+def add_counts(total, counts):
+    """
+    :param total The running counts, or None before the first chunk
+    :param counts The counts for the next chunk, as from count_pairs
+    :return The combined counts
+    """
+    if total is None:
+        return counts
+
+    # A cell may be missing from both tables, where a row only one of
+    # them has meets a column only the other has; count it as zero
+    return total.add(counts, fill_value=0).fillna(0).astype(np.int64)
+
+def read_chunks(columns, source=PRIMARY_DATA_PATH, chunksize=CHUNK_SIZE):
+    """
+    :param columns The columns to read
+    :param source The path to the original SPSS dataset
+    :param chunksize The number of rows to read at a time
+    :return An iterator over the SPSS file, one chunk of rows at a time
+    """
+    # Only needed for streaming, which the application itself never does
+    import pyreadstat
+
+    reader = pyreadstat.read_file_in_chunks(
+        pyreadstat.read_sav, source, chunksize=chunksize, usecols=list(columns))
+    for chunk, _ in reader:
+        yield chunk
+
+def stream_counts(pairs, source=PRIMARY_DATA_PATH, chunksize=CHUNK_SIZE):
+    """
+    Count pairs of codes over the SPSS file one chunk of rows at
+    a time, so that the full respondent table is never materialized.
+
+    :param pairs Map name -> (row column, column column) to count
+    :param source The path to the original SPSS dataset
+    :param chunksize The number of rows to read at a time
+    :return Map name -> the counts for that pair, as from count_pairs
+    """
+    columns = sorted({column for pair in pairs.values() for column in pair})
+
+    totals = dict.fromkeys(pairs)
+    for chunk in read_chunks(columns, source, chunksize):
+        for name, (row, column) in pairs.items():
+            totals[name] = add_counts(totals[name], count_pairs(chunk, row, column))
+    return totals
+
+def write_counts(counts, fingerprint, path=COUNTS_PATH):
+    """
+    :param counts Map name -> counts, as from stream_counts
+    :param fingerprint The fingerprint of the dataset that was counted
+    :param path The path to which the counts are written
+    """
+    arrays = {FINGERPRINT_KEY.decode(): np.array(fingerprint)}
+    for name, table in counts.items():
+        arrays[name + ".index"] = table.index.to_numpy(np.float64)
+        arrays[name + ".columns"] = table.columns.to_numpy(np.float64)
+        arrays[name + ".values"] = table.to_numpy(np.int64)
+
+    def write(tmp):
+        with open(tmp, "wb") as f:
+            np.savez(f, **arrays)
+    replace_file(path, write)
+
+def read_counts(path=COUNTS_PATH):
+    """
+    :param path The path to the counts
+    :return Map name -> counts, as from stream_counts
+    """
+    counts = {}
+    with np.load(path) as arrays:
+        for key in arrays.files:
+            if key.endswith(".values"):
+                name = key[:-len(".values")]
+                counts[name] = pd.DataFrame(
+                    arrays[key], 
+                    index=arrays[name + ".index"], 
+                    columns=arrays[name + ".columns"])
+    return counts
+
+def counts_fingerprint(path=COUNTS_PATH):
+    """
+    :param path The path to the counts
+    :return The fingerprint recorded with the counts, or None if there are none
+    """
+    if not os.path.exists(path):
+        return None
+    with np.load(path) as arrays:
+        return str(arrays[FINGERPRINT_KEY.decode()])
+
+def are_counts_fresh(source=PRIMARY_DATA_PATH, path=COUNTS_PATH):
+    """
+    :param source The path to the original SPSS dataset
+    :param path The path to the counts
+    :return True if the counts may be used in place of the respondents
+    """
+    # Deployments of surveys too large to load may ship only the counts
+    if not os.path.exists(source):
+        return os.path.exists(path)
+    return counts_fingerprint(path) == source_fingerprint(source)
+
+# -----------------------------------------------------------------------------
+# Main
+# -----------------------------------------------------------------------------
+
+def main():
+    print("[+] Converting '{}'...".format(PRIMARY_DATA_PATH))
+    convert_primary_data()
+    print("[+] Done!")
+
+# -----------------------------------------------------------------------------
+# Script Entry Point
+# -----------------------------------------------------------------------------
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,265 @@
+# synthetic.py
+#
+# A generator of synthetic respondent files for scale testing.
+#
+# The primary survey is not distributed with the repository, so this
+# writes a stand-in with the columns and response codes that the
+# application and the preprocessing scripts read, taken from the same
+# codebooks they use. Religions, states and ages are skewed roughly
+# as in the US population, and every answer is drawn from a response
+# distribution that depends on the respondent's religion, so that the
+# chapters show differences between religions as they do for the
+# real survey. The answers are otherwise not realistic.
+#
+# The format follows the extension of the output path:
+#   .sav      SPSS, as data/data.sav; read by every loader, including
+#             the streaming ones. The whole file is built in memory.
+#   .arrow    The converted format, as data/data.arrow; the application
+#             reads it as-is when there is no data/data.sav
+#   .parquet  Parquet
+# Arrow and Parquet files are written in chunks of rows, so any number
+# of respondents can be generated in bounded memory.
+#
+#   python synthetic.py 1000000 data/data.sav
+
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+import evolution
+import streamlit_app as app
+import survey
+
+# -----------------------------------------------------------------------------
+# General Constants
+# -----------------------------------------------------------------------------
+
+# The default number of respondents, as in the real survey
+ROWS = 35000
+
+# The default output path
+OUTPUT_PATH = survey.DATA_PATH + "synthetic.sav"
+
+# The seed for the random number generator, so that files are reproducible
+SEED = 2014
+
+# The share of respondents who did not answer each question
+MISSING_RATE = 0.05
+
+# Every religion is given its own response distribution for each question,
+# drawn with this concentration; smaller values differ more between religions
+CONCENTRATION = 2.0
+
+# The response code for "don't know"; fewer respondents give it
+UNSURE_CODE = 9.0
+UNSURE_WEIGHT = 0.1
+
+# The share of respondents (percent) with one of the religion codes that
+# the analysis drops, split equally between those codes
+DROPPED_RELIGION_SHARE = 1.5
+
+# Map religion code -> approximate share of respondents (percent)
+RELIGION_SHARES = {
+    1.0:  46.5,
+    2.0:  20.8,
+    3.0:  1.6,
+    4.0:  0.5,
+    5.0:  1.9,
+    6.0:  0.9,
+    7.0:  0.7,
+    8.0:  0.7,
+    9.0:  3.1,
+    10.0: 4.0,
+    12.0: 15.8,
+    13.0: 1.0,
+    14.0: 0.3,
+    15.0: 0.8,
+    99.0: 0.6
+}
+
+# Map state code -> approximate population (millions)
+STATE_POPULATIONS = {
+    1.0:  4.85, 2.0:  0.74, 4.0:  6.73, 5.0:  2.97, 6.0:  38.8,
+    8.0:  5.36, 9.0:  3.6,  10.0: 0.94, 11.0: 0.66, 12.0: 19.9,
+    13.0: 10.1, 15.0: 1.42, 16.0: 1.63, 17.0: 12.9, 18.0: 6.6,
+    19.0: 3.11, 20.0: 2.9,  21.0: 4.41, 22.0: 4.65, 23.0: 1.33,
+    24.0: 5.98, 25.0: 6.75, 26.0: 9.91, 27.0: 5.46, 28.0: 2.99,
+    29.0: 6.06, 30.0: 1.02, 31.0: 1.88, 32.0: 2.84, 33.0: 1.33,
+    34.0: 8.94, 35.0: 2.09, 36.0: 19.75, 37.0: 9.94, 38.0: 0.74,
+    39.0: 11.59, 40.0: 3.88, 41.0: 3.97, 42.0: 12.79, 44.0: 1.06,
+    45.0: 4.83, 46.0: 0.85, 47.0: 6.55, 48.0: 26.96, 49.0: 2.94,
+    50.0: 0.63, 51.0: 8.33, 53.0: 7.06, 54.0: 1.85, 55.0: 5.76,
+    56.0: 0.58
+}
+
+# Map age label -> approximate share of adults in its age group (percent)
+AGE_SHARES = {
+    1.0:  12.0, 2.0:  9.0, 3.0:  9.0, 4.0:  8.5, 5.0:  8.5,
+    6.0:  8.5,  7.0:  9.0, 8.0:  9.0, 9.0:  8.0, 10.0: 6.5,
+    11.0: 5.0,  12.0: 3.5, 13.0: 2.0, 14.0: 1.0, 15.0: 0.5
+}
+
+# -----------------------------------------------------------------------------
+# Codebooks
+# -----------------------------------------------------------------------------
+
+def answer_codes():
+    """
+    :return Map question column -> its response codes, for every
+    question read by the 'connection' and 'evolution' chapters
+    """
+    codes = {}
+    for column, belief in app.BELIEF_DICT.items():
+        if column != "qe1":
+            codes[column] = set(app.BELIEF_RESPONSE_DICTS[belief])
+    for q in evolution.QUESTIONS:
+        codes[q.question] = codes.get(q.question, set()) | set(q.response_map)
+    return {column: sorted(c) for column, c in codes.items()}
+
+def shares(codes, known, rest=1.0):
+    """
+    :param codes Every code
+    :param known Map code -> share, for some of the codes
+    :param rest The share left to the other codes
+    :return The probability of each code
+    """
+    others = [code for code in codes if code not in known]
+    p = np.array([known.get(code, rest / max(len(others), 1)) for code in codes])
+    return p / p.sum()
+
+# -----------------------------------------------------------------------------
+# Generator
+# -----------------------------------------------------------------------------
+
+class Generator:
+    def __init__(self, seed=SEED):
+        self.rng = np.random.default_rng(seed)
+
+        self.religions = np.array(list(app.RELIGION_DICT) + app.DROPPED_RELIGION_CODES)
+        self.religion_p = shares(self.religions, RELIGION_SHARES, rest=DROPPED_RELIGION_SHARE)
+        self.states = np.array(list(app.STATE_DICT))
+        self.state_p = shares(self.states, STATE_POPULATIONS)
+        self.ages = np.array(sorted(evolution.AGE_MAP))
+        self.age_p = shares(self.ages, AGE_SHARES)
+
+        # Map question column -> (codes, cumulative response
+        # distribution for each religion, one row per religion)
+        self.answers = {}
+        for column, codes in answer_codes().items():
+            alpha = np.where(np.array(codes) == UNSURE_CODE, UNSURE_WEIGHT, 1.0)*CONCENTRATION
+            p = self.rng.dirichlet(alpha, size=len(self.religions))
+            self.answers[column] = (np.array(codes), np.cumsum(p, axis=1))
+
+    def choice(self, codes, cumulative, size):
+        """
+        :param codes The codes to choose from
+        :param cumulative The cumulative distribution, or one per row
+        :param size The number of rows
+        :return The index of the code drawn for each row
+        """
+        u = self.rng.random(size)[:, np.newaxis]
+        index = (u > np.atleast_2d(cumulative)).sum(axis=1)
+        return np.minimum(index, len(codes) - 1)
+
+    def chunk(self, rows):
+        """
+        :param rows The number of respondents
+        :return A dataframe of that many respondents, with compact codes
+        """
+        religion = self.choice(self.religions, np.cumsum(self.religion_p), rows)
+        columns = {
+            "qe1":    self.religions[religion].astype(np.uint16),
+            "state":  self.states[self.choice(self.states, np.cumsum(self.state_p), rows)].astype(np.uint8),
+            evolution.AGE_KEY: self.ages[self.choice(self.ages, np.cumsum(self.age_p), rows)].astype(np.uint8)
+        }
+
+        for column, (codes, cumulative) in self.answers.items():
+            answers = pd.array(codes[self.choice(codes, cumulative[religion], rows)].astype(np.uint8), dtype="UInt8")
+            answers[self.rng.random(rows) < MISSING_RATE] = pd.NA
+            columns[column] = answers
+        return pd.DataFrame(columns)
+
+    def chunks(self, rows, chunksize=survey.CHUNK_SIZE):
+        """
+        :param rows The total number of respondents
+        :param chunksize The number of respondents in each chunk
+        :return An iterator over the respondents, one chunk at a time
+        """
+        for start in range(0, rows, chunksize):
+            yield self.chunk(min(chunksize, rows - start))
+
+# -----------------------------------------------------------------------------
+# Writers
+# -----------------------------------------------------------------------------
+
+def write_sav(chunks, path):
+    import pyreadstat
+
+    # SPSS stores every code as a double; there is no way to append
+    df = pd.concat(chunks, ignore_index=True).astype(np.float64)
+    pyreadstat.write_sav(df, path)
+
+def write_tables(chunks, open_writer):
+    """
+    :param chunks An iterator over the respondents, one chunk at a time
+    :param open_writer A function of the schema that opens the writer
+    """
+    writer = None
+    for chunk in chunks:
+        table = pa.Table.from_pandas(chunk, preserve_index=False)
+        if writer is None:
+            schema = table.schema
+            writer = open_writer(schema)
+        writer.write_table(table.cast(schema))
+    writer.close()
+
+def write_arrow(chunks, path):
+    write_tables(chunks, lambda schema: pa.ipc.new_file(path, schema))
+
+def write_parquet(chunks, path):
+    write_tables(chunks, lambda schema: pq.ParquetWriter(path, schema))
+
+# Map file extension -> writer
+WRITERS = {
+    ".sav":     write_sav,
+    ".arrow":   write_arrow,
+    ".parquet": write_parquet
+}
+
+def generate(rows, path, seed=SEED):
+    """
+    :param rows The number of respondents
+    :param path The output path, whose extension selects the format
+    :param seed The seed for the random number generator
+    """
+    extension = os.path.splitext(path)[1]
+    if extension not in WRITERS:
+        raise ValueError("Unsupported output format '{}'".format(extension))
+    WRITERS[extension](Generator(seed).chunks(rows), path)
+
+# -----------------------------------------------------------------------------
+# Main
+# -----------------------------------------------------------------------------
+
+def main():
+    rows = int(sys.argv[1]) if len(sys.argv) > 1 else ROWS
+    path = sys.argv[2] if len(sys.argv) > 2 else OUTPUT_PATH
+
+    # Never replace the real survey by accident
+    if os.path.exists(path):
+        sys.exit("[-] '{}' already exists; remove it first".format(path))
+
+    print("[+] Generating {} respondents to '{}'...".format(rows, path))
+    generate(rows, path)
+    print("[+] Done!")
+
+# -----------------------------------------------------------------------------
+# Script Entry Point
+# -----------------------------------------------------------------------------
+
+if __name__ == "__main__":
+    main()
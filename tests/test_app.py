@@ -0,0 +1,17 @@
+import numpy as np
+
+import streamlit_app as app
+import survey
+import synthetic
+
+def test_belief_cube_from_streamed_counts_matches_respondents(tmp_path):
+    source = str(tmp_path / "data.sav")
+    synthetic.generate(5000, source)
+
+    respondents = survey.read_primary_data(app.CONNECTION_COLUMNS, source, str(tmp_path / "data.arrow"))
+    cube = app.create_belief_cube(app.create_belief_df(respondents))
+
+    counts = survey.stream_counts(app.COUNT_PAIRS, source=source, chunksize=700)
+    streamed = app.create_belief_cube_from_counts(counts)
+
+    np.testing.assert_array_equal(streamed, cube)
@@ -0,0 +1,56 @@
+from chartcache import ChartCache
+
+def build(spec):
+    """
+    :param spec The spec to build
+    :return A build function that records each of its calls
+    """
+    def build_spec():
+        build_spec.calls += 1
+        return spec
+    build_spec.calls = 0
+    return build_spec
+
+def test_get_builds_only_on_a_miss():
+    cache = ChartCache(maxsize=2)
+    spec = build({"mark": "bar"})
+
+    assert cache.get("a", spec) == {"mark": "bar"}
+    assert cache.get("a", spec) is cache.get("a", spec)
+
+    assert spec.calls == 1
+    assert cache.stats() == {"hits": 2, "misses": 1, "size": 1, "maxsize": 2}
+
+def test_get_evicts_the_least_recently_used_spec():
+    cache = ChartCache(maxsize=2)
+    cache.get("a", build("a"))
+    cache.get("b", build("b"))
+
+    # A hit on "a" moves it to the end, so "b" is evicted instead
+    cache.get("a", build("not built"))
+    cache.get("c", build("c"))
+
+    assert list(cache.specs) == ["a", "c"]
+    assert len(cache) == 2
+
+    rebuilt = build("b")
+    assert cache.get("b", rebuilt) == "b"
+    assert rebuilt.calls == 1
+    assert list(cache.specs) == ["c", "b"]
+
+def test_get_never_keeps_more_than_maxsize_specs():
+    cache = ChartCache(maxsize=3)
+    for key in range(10):
+        cache.get(key, build(key))
+
+    assert list(cache.specs) == [7, 8, 9]
+    assert cache.stats() == {"hits": 0, "misses": 10, "size": 3, "maxsize": 3}
+
+def test_clear_resets_the_counters():
+    cache = ChartCache(maxsize=2)
+    cache.get("a", build("a"))
+    cache.get("a", build("a"))
+
+    cache.clear()
+
+    assert cache.stats() == {"hits": 0, "misses": 0, "size": 0, "maxsize": 2}
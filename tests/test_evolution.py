@@ -0,0 +1,25 @@
+import numpy as np
+import pandas as pd
+import pyreadstat
+
+import evolution
+import survey
+
+def test_count_all_responses_on_converted_survey(tmp_path):
+    # Missing answers make the converted columns nullable
+    rng = np.random.default_rng(0)
+    df = pd.DataFrame({evolution.AGE_KEY: rng.choice(list(evolution.AGE_MAP), 3000)})
+    for q in evolution.QUESTIONS:
+        answers = rng.choice(list(q.response_map), 3000)
+        df[q.question] = np.where(rng.random(3000) < 0.05, np.nan, answers)
+    source = str(tmp_path / "data.sav")
+    pyreadstat.write_sav(df, source)
+
+    converted = survey.read_primary_data(evolution.COLUMNS, source, str(tmp_path / "data.arrow"))
+    counts = evolution.count_all_responses(converted)
+
+    for q in evolution.QUESTIONS:
+        assert (counts[q.question].dtypes == np.int64).all()
+        pd.testing.assert_frame_equal(
+            evolution.processor_from_counts(counts[q.question], q.response_map),
+            evolution.processor(df, q.question, q.response_map))
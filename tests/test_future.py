@@ -0,0 +1,53 @@
+import numpy as np
+import pytest
+
+import future
+
+# Starting distributions that differ from the initial one, so that every
+# row of the batch projects differently
+STARTS = np.stack([
+    future.INITIAL_DISTRIBUTION,
+    np.full(future.INITIAL_DISTRIBUTION.size, 2.0),
+    np.arange(1, future.INITIAL_DISTRIBUTION.size + 1, dtype=np.float64)])
+
+@pytest.mark.parametrize("horizon", [1, 2, 7, 64, 100, 1000])
+def test_project_matches_the_trajectory(horizon):
+    trajectory = future.project_trajectory(future.INITIAL_DISTRIBUTION, horizon)
+
+    projection = future.project(future.INITIAL_DISTRIBUTION, horizon)
+
+    assert projection.shape == future.INITIAL_DISTRIBUTION.shape
+    np.testing.assert_allclose(projection, trajectory[-1], rtol=1e-12, atol=1e-15)
+
+def test_project_batches_starts():
+    horizon = 37
+    trajectory = future.project_trajectory(STARTS, horizon)
+
+    projection = future.project(STARTS, horizon)
+
+    assert projection.shape == STARTS.shape
+    np.testing.assert_allclose(projection, trajectory[-1], rtol=1e-12, atol=1e-15)
+
+def test_project_reuses_powers():
+    powers = future.matrix_powers(future.step_matrix(), 7)
+
+    for horizon in (5, 64, 127):
+        np.testing.assert_allclose(
+            future.project(STARTS, horizon, powers),
+            future.project(STARTS, horizon),
+            rtol=1e-12, atol=1e-15)
+
+@pytest.mark.parametrize("horizon", [np.int64(50), np.int32(50), np.uint8(50)])
+def test_project_accepts_numpy_integer_horizons(horizon):
+    np.testing.assert_array_equal(
+        future.project(STARTS, horizon),
+        future.project(STARTS, 50))
+
+def test_project_rejects_fractional_horizons():
+    with pytest.raises(TypeError):
+        future.project(STARTS, 50.0)
+
+def test_project_at_horizon_zero_normalizes_the_starts():
+    projection = future.project(STARTS, 0)
+
+    np.testing.assert_allclose(projection, STARTS / STARTS.sum(axis=1, keepdims=True))
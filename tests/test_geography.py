@@ -0,0 +1,82 @@
+import numpy as np
+
+import geography
+
+# Absolute positions on the input grid of every arc of the topology below
+SHARED = [(104, 0), (101, 50), (104, 100)]
+COUNTY = [(10, 10), (20, 20)]
+WEST = [(104, 100), (0, 100), (0, 0), (104, 0)]
+EAST = [(104, 100), (200, 100), (200, 0), (104, 0)]
+ISLAND = [(300, 300), (303, 300), (303, 303), (300, 303), (300, 300)]
+CIRCLE = [
+    (500 + round(100*np.cos(t)), 500 + round(100*np.sin(t)))
+    for t in np.linspace(0, 2*np.pi, 31)]
+
+def build_topology():
+    """
+    :return Three states and a county: the west and east states share a
+    border, the west state also owns an island too small for the output
+    grid, and the third state is a single closed arc
+    """
+    arcs = [SHARED, COUNTY, WEST, EAST, ISLAND, CIRCLE]
+    return {
+        "type": "Topology",
+        "transform": {"scale": [0.5, 0.25], "translate": [-120, 30]},
+        "objects": {
+            "states": {"type": "GeometryCollection", "geometries": [
+                {"type": "MultiPolygon", "id": 1, "arcs": [[[0, 2]], [[4]]]},
+                {"type": "Polygon", "id": 2, "arcs": [[~0, ~3]]},
+                {"type": "Polygon", "id": 3, "arcs": [[5]]}]},
+            "counties": {"type": "GeometryCollection", "geometries": [
+                {"type": "LineString", "id": 1001, "arcs": [1]}]}},
+        "arcs": [geography.encode_arc(np.array(arc)) for arc in arcs]}
+
+def reduced_arcs(reduced):
+    return [geography.decode_arc(arc) for arc in reduced["arcs"]]
+
+def test_reduce_topology_drops_counties_and_renumbers_arcs():
+    reduced = geography.reduce_topology(build_topology())
+
+    assert list(reduced["objects"]) == ["states"]
+    assert len(reduced["arcs"]) == 4
+    geometries = reduced["objects"]["states"]["geometries"]
+    assert [g["arcs"] for g in geometries] == [[[[0, 1]]], [[~0, ~2]], [[3]]]
+
+def test_reduce_topology_drops_rings_that_collapse():
+    reduced = geography.reduce_topology(build_topology())
+
+    west = reduced["objects"]["states"]["geometries"][0]
+    assert west["type"] == "MultiPolygon"
+    assert len(west["arcs"]) == 1
+
+def test_reduce_topology_keeps_shared_endpoints_identical():
+    reduced = geography.reduce_topology(build_topology())
+    arcs = reduced_arcs(reduced)
+
+    for geometry in reduced["objects"]["states"]["geometries"]:
+        rings = geometry["arcs"] if geometry["type"] == "Polygon" else sum(geometry["arcs"], [])
+        for ring in rings:
+            points = [arcs[i] if i >= 0 else arcs[~i][::-1] for i in ring]
+            for previous, current in zip(points, points[1:] + points[:1]):
+                assert (previous[-1] == current[0]).all()
+
+    # The shared border is a straight line on the output grid
+    assert arcs[0].tolist() == [[10, 0], [10, 10]]
+
+def test_reduce_topology_keeps_the_anchors_of_closed_rings():
+    reduced = geography.reduce_topology(build_topology())
+    circle = reduced_arcs(reduced)[3].tolist()
+
+    factor = geography.QUANTIZATION_FACTOR
+    for i in (len(CIRCLE) // 3, 2*len(CIRCLE) // 3):
+        x, y = CIRCLE[i]
+        assert [round(x / factor), round(y / factor)] in circle
+    assert circle[0] == circle[-1]
+    assert len(circle) >= 4
+
+def test_reduce_topology_scales_the_transform():
+    reduced = geography.reduce_topology(build_topology())
+
+    factor = geography.QUANTIZATION_FACTOR
+    assert reduced["transform"]["scale"] == [0.5*factor, 0.25*factor]
+    assert reduced["transform"]["translate"] == [-120, 30]
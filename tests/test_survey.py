@@ -0,0 +1,41 @@
+import numpy as np
+import pandas as pd
+import pyreadstat
+
+import survey
+
+def test_add_counts_fills_cells_missing_from_both_tables():
+    first = pd.DataFrame({"a": [1, 2]}, index=[1.0, 2.0])
+    second = pd.DataFrame({"a": [3], "b": [4]}, index=[1.0])
+
+    total = survey.add_counts(survey.add_counts(None, first), second)
+
+    expected = pd.DataFrame({"a": [4, 2], "b": [4, 0]}, index=[1.0, 2.0])
+    pd.testing.assert_frame_equal(total, expected)
+
+def test_stream_counts_matches_counting_at_once(tmp_path):
+    # Sorted by state, so that every chunk holds states and religions the others lack
+    rng = np.random.default_rng(0)
+    df = pd.DataFrame({
+        "state": np.sort(rng.integers(1, 20, 2000)).astype(np.float64),
+        "qe1":   rng.integers(1, 15, 2000).astype(np.float64)})
+    df.loc[rng.random(2000) < 0.05, "qe1"] = np.nan
+    source = str(tmp_path / "data.sav")
+    pyreadstat.write_sav(df.sort_values(["state", "qe1"]), source)
+
+    counts = survey.stream_counts({"states": ("state", "qe1")}, source=source, chunksize=100)
+
+    expected = survey.count_pairs(df, "state", "qe1")
+    pd.testing.assert_frame_equal(
+        counts["states"].sort_index().sort_index(axis=1), 
+        expected.sort_index().sort_index(axis=1), 
+        check_dtype=False)
+
+def test_counts_round_trip(tmp_path):
+    counts = {"states": pd.DataFrame({1.0: [1, 2], np.nan: [0, 3]}, index=[4.0, np.nan])}
+    path = str(tmp_path / "counts.npz")
+
+    survey.write_counts(counts, "v1", path)
+
+    assert survey.counts_fingerprint(path) == "v1"
+    pd.testing.assert_frame_equal(survey.read_counts(path)["states"], counts["states"])
@@ -0,0 +1,164 @@
+# timing.py
+#
+# Timing spans for finding where the time in a rerun goes.
+#
+# A span times one named step (loading a dataset, aggregating it, or
+# building, serializing or displaying a chart). The durations of each
+# span are kept for every session in this process, and summarized as
+# percentiles over the most recent samples. The summary can be exported
+# as JSON lines, or in the Prometheus text format (as a summary metric),
+# for example for the textfile collector of the node exporter.
+
+import functools
+import json
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+import numpy as np
+
+# -----------------------------------------------------------------------------
+# General Constants
+# -----------------------------------------------------------------------------
+
+# The number of most recent durations kept for each span
+SAMPLES = 1000
+
+# The percentiles reported for each span
+PERCENTILES = (50, 95)
+
+# The name of the exported metric
+METRIC_NAME = "streamlit_app_span_seconds"
+
+# -----------------------------------------------------------------------------
+# Registry
+# -----------------------------------------------------------------------------
+
+class Timings:
+    def __init__(self, samples=SAMPLES):
+        """
+        :param samples The number of most recent durations kept for each span
+        """
+        self.samples = samples
+        self.spans = {}
+        self.lock = threading.Lock()
+
+    def record(self, name, seconds):
+        """
+        :param name The name of the span
+        :param seconds The duration of the span
+        """
+        with self.lock:
+            if name not in self.spans:
+                self.spans[name] = {"count": 0, "sum": 0.0, "recent": deque(maxlen=self.samples)}
+            span = self.spans[name]
+            span["count"] += 1
+            span["sum"] += seconds
+            span["recent"].append(seconds)
+
+    def clear(self):
+        with self.lock:
+            self.spans.clear()
+
+    def summary(self):
+        """
+        :return One dict per span, ordered by name, with the number of times
+        it ran, its total duration and the percentiles of its recent durations
+        """
+        with self.lock:
+            spans = {name: (s["count"], s["sum"], list(s["recent"])) for name, s in self.spans.items()}
+
+        rows = []
+        for name, (count, total, recent) in sorted(spans.items()):
+            row = {"span": name, "count": count, "sum": total}
+            for percentile, value in zip(PERCENTILES, np.percentile(recent, PERCENTILES)):
+                row["p{}".format(percentile)] = float(value)
+            rows.append(row)
+        return rows
+
+# The timings of every session in this process
+TIMINGS = Timings()
+
+# -----------------------------------------------------------------------------
+# Spans
+# -----------------------------------------------------------------------------
+
+# The names of the spans open in each thread (each session runs in its own)
+_open_spans = threading.local()
+
+@contextmanager
+def span(name, timings=TIMINGS):
+    """
+    Time the enclosed block as the named span.
+
+    :param name The name of the span
+    :param timings The registry in which the duration is recorded
+    """
+    names = _open_spans.__dict__.setdefault("names", [])
+    names.append(name)
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings.record(name, time.perf_counter() - start)
+        names.pop()
+
+def is_open(name):
+    """
+    :param name The name of a span
+    :return True if a span of that name encloses the caller, in this thread
+    """
+    return name in getattr(_open_spans, "names", ())
+
+def timed(function):
+    """
+    Time every call of the decorated function as a span named after it.
+    """
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        with span(function.__name__):
+            return function(*args, **kwargs)
+    return wrapper
+
+# -----------------------------------------------------------------------------
+# Export
+# -----------------------------------------------------------------------------
+
+def to_jsonl(timings=TIMINGS):
+    """
+    :return The summary of every span as JSON lines, one span per line
+    """
+    now = time.time()
+    return "".join(json.dumps(dict(row, time=now)) + "\n" for row in timings.summary())
+
+def to_prometheus(timings=TIMINGS):
+    """
+    :return The summary of every span in the Prometheus text format
+    """
+    lines = [
+        "# HELP {} Duration of each step of the application.".format(METRIC_NAME),
+        "# TYPE {} summary".format(METRIC_NAME)]
+    for row in timings.summary():
+        label = 'span="{}"'.format(row["span"])
+        for percentile in PERCENTILES:
+            lines.append('{}{{{},quantile="{}"}} {!r}'.format(
+                METRIC_NAME, label, percentile / 100, row["p{}".format(percentile)]))
+        lines.append("{}_sum{{{}}} {!r}".format(METRIC_NAME, label, row["sum"]))
+        lines.append("{}_count{{{}}} {}".format(METRIC_NAME, label, row["count"]))
+    return "\n".join(lines) + "\n"
+
+def write_metrics(path, timings=TIMINGS):
+    """
+    :param path The path to which the summary is written: as JSON lines
+    if it ends in .jsonl, and in the Prometheus text format otherwise
+    """
+    text = to_jsonl(timings) if path.endswith(".jsonl") else to_prometheus(timings)
+
+    # Replace the file at once, so that collectors never read it half-written;
+    # sessions write from their own threads, so each uses its own temporary file
+    tmp = "{}.{}.tmp".format(path, threading.get_ident())
+    with open(tmp, "w") as f:
+        f.write(text)
+    os.replace(tmp, path)